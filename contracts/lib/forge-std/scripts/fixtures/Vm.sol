@@ -0,0 +1,377 @@
+// Automatically @generated by scripts/vm.py. Do not modify manually.
+
+// SPDX-License-Identifier: MIT OR Apache-2.0
+pragma solidity >=0.8.13 <0.9.0;
+
+/// The `VmSafe` interface does not allow manipulation of the EVM state or other actions that may
+/// result in Script simulations differing from on-chain execution. It is recommended to only use
+/// these cheats in scripts.
+interface VmSafe {
+    /// A modification applied to either `msg.sender` or `tx.origin`. Returned by `readCallers`.
+    enum CallerMode {
+        // No caller modification is currently active.
+        None,
+        // A one time broadcast triggered by a `vm.broadcast()` call is currently active.
+        Broadcast,
+        // A recurrent broadcast triggered by a `vm.startBroadcast()` call is currently active.
+        RecurrentBroadcast,
+        // A one time prank triggered by a `vm.prank()` call is currently active.
+        Prank,
+        // A recurrent prank triggered by a `vm.startPrank()` call is currently active.
+        RecurrentPrank
+    }
+
+    /// The kind of account access that occurred.
+    enum AccountAccessKind {
+        // The account was called.
+        Call,
+        // The account was called via delegatecall.
+        DelegateCall,
+        // The account was called via callcode.
+        CallCode,
+        // The account was called via staticcall.
+        StaticCall,
+        // The account was created.
+        Create,
+        // The account was selfdestructed.
+        SelfDestruct,
+        // Synthetic access indicating the current context has resumed after a previous sub-context (AccountAccess).
+        Resume,
+        // The account's balance was read.
+        Balance,
+        // The account's codesize was read.
+        Extcodesize,
+        // The account's codehash was read.
+        Extcodehash,
+        // The account's code was copied.
+        Extcodecopy
+    }
+
+    /// A wallet with a public and private key.
+    struct Wallet {
+        // The wallet's address.
+        address addr;
+        // The wallet's public key `X`.
+        uint256 publicKeyX;
+        // The wallet's public key `Y`.
+        uint256 publicKeyY;
+        // The wallet's private key.
+        uint256 privateKey;
+    }
+
+    /// Information on the chain and fork.
+    struct ChainInfo {
+        // The fork identifier. Set to zero if no fork is active.
+        uint256 forkId;
+        // The chain ID of the current fork.
+        uint256 chainId;
+    }
+
+    /// The result of a `stopAndReturnStateDiff` call.
+    struct AccountAccess {
+        // The chain and fork the access occurred.
+        ChainInfo chainInfo;
+        // The kind of account access that determines what the account is.
+        // If kind is Call, DelegateCall, StaticCall or CallCode, then the account is the callee.
+        // If kind is Create, then the account is the newly created account.
+        // If kind is SelfDestruct, then the account is the selfdestruct recipient.
+        // If kind is a Resume, then account represents a account context that has resumed.
+        AccountAccessKind kind;
+        // The account that was accessed.
+        // It's either the account created, callee or a selfdestruct recipient for CREATE, CALL or SELFDESTRUCT.
+        address account;
+        // What accessed the account.
+        address accessor;
+        // If the account was initialized or empty prior to the access.
+        // An account is considered initialized if it has code, a
+        // non-zero nonce, or a non-zero balance.
+        bool initialized;
+        // The previous balance of the accessed account.
+        uint256 oldBalance;
+        // The potential new balance of the accessed account.
+        // That is, all balance changes are recorded here, even if reverts occurred.
+        uint256 newBalance;
+        // Code of the account deployed by CREATE.
+        bytes deployedCode;
+        // Value passed along with the account access
+        uint256 value;
+        // Input data provided to the CREATE or CALL
+        bytes data;
+        // If this access reverted in either the current or parent context.
+        bool reverted;
+        // An ordered list of storage accesses made during an account access operation.
+        StorageAccess[] storageAccesses;
+        // Call depth traversed during the recording of state differences
+        uint64 depth;
+        // The previous nonce of the accessed account.
+        uint64 oldNonce;
+        // The new nonce of the accessed account.
+        uint64 newNonce;
+    }
+
+    /// The storage accessed during an `AccountAccess`.
+    struct StorageAccess {
+        // The account whose storage was accessed.
+        address account;
+        // The slot that was accessed.
+        bytes32 slot;
+        // If the access was a write.
+        bool isWrite;
+        // The previous value of the slot.
+        bytes32 previousValue;
+        // The new value of the slot.
+        bytes32 newValue;
+        // If the access was reverted.
+        bool reverted;
+    }
+
+    /// Holds a signed EIP-7702 authorization for an authority account to delegate to an implementation.
+    struct SignedDelegation {
+        // The y-parity of the recovered secp256k1 signature (0 or 1).
+        uint8 v;
+        // First 32 bytes of the signature.
+        bytes32 r;
+        // Second 32 bytes of the signature.
+        bytes32 s;
+        // The current nonce of the authority account at signing time.
+        // Used to ensure signature can't be replayed after account nonce changes.
+        uint64 nonce;
+        // Address of the contract implementation that will be delegated to.
+        // Gets encoded into delegation code: 0xef0100 || implementation.
+        address implementation;
+    }
+
+    // ======== Crypto ========
+
+    /// Derives a private key from the name, labels the account with that name, and returns the wallet.
+    function createWallet(string calldata walletLabel) external returns (Wallet memory wallet);
+
+    /// Generates a wallet from the private key and returns the wallet.
+    function createWallet(uint256 privateKey) external returns (Wallet memory wallet);
+
+    /// Generates a wallet from the private key, labels the account with that name, and returns the wallet.
+    function createWallet(uint256 privateKey, string calldata walletLabel) external returns (Wallet memory wallet);
+
+    /// Derive a private key from a provided mnemonic string (or mnemonic file path)
+    /// at the derivation path `m/44'/60'/0'/0/{index}`.
+    function deriveKey(string calldata mnemonic, uint32 index) external pure returns (uint256 privateKey);
+
+    /// Derive a private key from a provided mnemonic string (or mnemonic file path)
+    /// at `{derivationPath}{index}`.
+    function deriveKey(string calldata mnemonic, string calldata derivationPath, uint32 index)
+        external
+        pure
+        returns (uint256 privateKey);
+
+    /// Derive a private key from a provided mnemonic string (or mnemonic file path) in the specified language
+    /// at the derivation path `m/44'/60'/0'/0/{index}`.
+    function deriveKey(string calldata mnemonic, uint32 index, string calldata language)
+        external
+        pure
+        returns (uint256 privateKey);
+
+    /// Derive a private key from a provided mnemonic string (or mnemonic file path) in the specified language
+    /// at `{derivationPath}{index}`.
+    function deriveKey(string calldata mnemonic, string calldata derivationPath, uint32 index, string calldata language)
+        external
+        pure
+        returns (uint256 privateKey);
+
+    /// Derives secp256r1 public key from the provided `privateKey`.
+    function publicKeyP256(uint256 privateKey) external pure returns (uint256 publicKeyX, uint256 publicKeyY);
+
+    /// Adds a private key to the local forge wallet and returns the address.
+    function rememberKey(uint256 privateKey) external returns (address keyAddr);
+
+    /// Derive a set number of wallets from a mnemonic at the derivation path `m/44'/60'/0'/0/{0..count}`.
+    /// The respective private keys are saved to the local forge wallet for later use and their addresses are returned.
+    function rememberKeys(string calldata mnemonic, string calldata derivationPath, uint32 count)
+        external
+        returns (address[] memory keyAddrs);
+
+    /// Derive a set number of wallets from a mnemonic in the specified language at the derivation path `m/44'/60'/0'/0/{0..count}`.
+    /// The respective private keys are saved to the local forge wallet for later use and their addresses are returned.
+    function rememberKeys(
+        string calldata mnemonic,
+        string calldata derivationPath,
+        string calldata language,
+        uint32 count
+    ) external returns (address[] memory keyAddrs);
+
+    /// Signs data with a `Wallet`.
+    /// Returns a compact signature (`r`, `vs`) as per EIP-2098, where `vs` encodes both the
+    /// signature's `s` value, and the recovery id `v` in a single bytes32.
+    /// This format reduces the signature size from 65 to 64 bytes.
+    function signCompact(Wallet calldata wallet, bytes32 digest) external pure returns (bytes32 r, bytes32 vs);
+
+    /// Signs `digest` with `privateKey` using the secp256k1 curve.
+    /// Returns a compact signature (`r`, `vs`) as per EIP-2098, where `vs` encodes both the
+    /// signature's `s` value, and the recovery id `v` in a single bytes32.
+    /// This format reduces the signature size from 65 to 64 bytes.
+    function signCompact(uint256 privateKey, bytes32 digest) external pure returns (bytes32 r, bytes32 vs);
+
+    /// Signs `digest` with signer provided to script using the secp256k1 curve.
+    /// Returns a compact signature (`r`, `vs`) as per EIP-2098, where `vs` encodes both the
+    /// signature's `s` value, and the recovery id `v` in a single bytes32.
+    /// This format reduces the signature size from 65 to 64 bytes.
+    /// If `--sender` is provided, the signer with provided address is used, otherwise,
+    /// if exactly one signer is provided to the script, that signer is used.
+    /// Raises error if signer passed through `--sender` does not match any unlocked signers or
+    /// if `--sender` is not provided and not exactly one signer is passed to the script.
+    function signCompact(bytes32 digest) external pure returns (bytes32 r, bytes32 vs);
+
+    /// Signs `digest` with signer provided to script using the secp256k1 curve.
+    /// Returns a compact signature (`r`, `vs`) as per EIP-2098, where `vs` encodes both the
+    /// signature's `s` value, and the recovery id `v` in a single bytes32.
+    /// This format reduces the signature size from 65 to 64 bytes.
+    /// Raises error if none of the signers passed into the script have provided address.
+    function signCompact(address signer, bytes32 digest) external pure returns (bytes32 r, bytes32 vs);
+
+    /// Signs `digest` with `privateKey` using the secp256r1 curve.
+    function signP256(uint256 privateKey, bytes32 digest) external pure returns (bytes32 r, bytes32 s);
+
+    /// Signs `digest` with `privateKey` on the secp256k1 curve, using the given `nonce`
+    /// as the raw ephemeral k value in ECDSA (instead of deriving it deterministically).
+    function signWithNonceUnsafe(uint256 privateKey, bytes32 digest, uint256 nonce)
+        external
+        pure
+        returns (uint8 v, bytes32 r, bytes32 s);
+
+    /// Signs data with a `Wallet`.
+    function sign(Wallet calldata wallet, bytes32 digest) external pure returns (uint8 v, bytes32 r, bytes32 s);
+
+    /// Signs `digest` with `privateKey` using the secp256k1 curve.
+    function sign(uint256 privateKey, bytes32 digest) external pure returns (uint8 v, bytes32 r, bytes32 s);
+
+    /// Signs `digest` with signer provided to script using the secp256k1 curve.
+    /// If `--sender` is provided, the signer with provided address is used, otherwise,
+    /// if exactly one signer is provided to the script, that signer is used.
+    /// Raises error if signer passed through `--sender` does not match any unlocked signers or
+    /// if `--sender` is not provided and not exactly one signer is passed to the script.
+    function sign(bytes32 digest) external pure returns (uint8 v, bytes32 r, bytes32 s);
+
+    /// Signs `digest` with signer provided to script using the secp256k1 curve.
+    /// Raises error if none of the signers passed into the script have provided address.
+    function sign(address signer, bytes32 digest) external pure returns (uint8 v, bytes32 r, bytes32 s);
+
+    // ======== EVM ========
+
+    /// Returns an ordered array of all account accesses from a `vm.startStateDiffRecording` session.
+    function stopAndReturnStateDiff() external returns (AccountAccess[] memory accountAccesses);
+
+    // ======== Filesystem ========
+
+    /// Deploys a contract from an artifact file, using the CREATE2 salt. Takes in the relative path to the json file or the path to the
+    /// artifact in the form of <path>:<contract>:<version> where <contract> and <version> parts are optional.
+    /// Reverts if the target artifact contains unlinked library placeholders.
+    /// Additionally accepts abi-encoded constructor arguments and `msg.value`.
+    function deployCode(string calldata artifactPath, bytes calldata constructorArgs, uint256 value, bytes32 salt)
+        external
+        returns (address deployedAddress);
+
+    // ======== JSON ========
+
+    /// See `serializeJson`.
+    function serializeJsonType(
+        string calldata objectKey,
+        string calldata valueKey,
+        string calldata typeDescription,
+        bytes calldata value
+    ) external returns (string memory json);
+
+    // ======== Scripting ========
+
+    /// Sign an EIP-7702 authorization and designate the next call as an EIP-7702 transaction for specific nonce
+    function signAndAttachDelegation(address implementation, uint256 privateKey, uint64 nonce)
+        external
+        returns (SignedDelegation memory signedDelegation);
+
+    /// Sign an EIP-7702 authorization and designate the next call as an EIP-7702 transaction, with optional cross-chain validity.
+    function signAndAttachDelegation(address implementation, uint256 privateKey, bool crossChain)
+        external
+        returns (SignedDelegation memory signedDelegation);
+
+    // ======== String ========
+
+    /// Returns true if `search` is found in `subject`, false otherwise.
+    function contains(string calldata subject, string calldata search) external pure returns (bool result);
+
+    /// Returns the index of the first occurrence of a `key` in an `input` string.
+    /// Returns `NOT_FOUND` (i.e. `type(uint256).max`) if the `key` is not found.
+    /// Returns 0 in case of an empty `key`.
+    function indexOf(string calldata input, string calldata key) external pure returns (uint256);
+
+    /// Parses the given `string` into an `address`.
+    function parseAddress(string calldata stringifiedValue) external pure returns (address parsedValue);
+
+    /// Parses the given `string` into a `bool`.
+    function parseBool(string calldata stringifiedValue) external pure returns (bool parsedValue);
+
+    /// Parses the given `string` into `bytes`.
+    function parseBytes(string calldata stringifiedValue) external pure returns (bytes memory parsedValue);
+
+    /// Parses the given `string` into a `bytes32`.
+    function parseBytes32(string calldata stringifiedValue) external pure returns (bytes32 parsedValue);
+
+    /// Parses the given `string` into a `int256`.
+    function parseInt(string calldata stringifiedValue) external pure returns (int256 parsedValue);
+
+    /// Parses the given `string` into a `uint256`.
+    function parseUint(string calldata stringifiedValue) external pure returns (uint256 parsedValue);
+
+    /// Replaces occurrences of `from` in the given `string` with `to`.
+    function replace(string calldata input, string calldata from, string calldata to)
+        external
+        pure
+        returns (string memory output);
+
+    /// Splits the given `string` into an array of strings divided by the `delimiter`.
+    function split(string calldata input, string calldata delimiter) external pure returns (string[] memory outputs);
+
+    /// Converts the given `string` value to Lowercase.
+    function toLowercase(string calldata input) external pure returns (string memory output);
+
+    /// Converts the given value to a `string`.
+    function toString(address value) external pure returns (string memory stringifiedValue);
+
+    /// Converts the given value to a `string`.
+    function toString(bytes calldata value) external pure returns (string memory stringifiedValue);
+
+    /// Converts the given value to a `string`.
+    function toString(bytes32 value) external pure returns (string memory stringifiedValue);
+
+    /// Converts the given value to a `string`.
+    function toString(bool value) external pure returns (string memory stringifiedValue);
+
+    /// Converts the given value to a `string`.
+    function toString(uint256 value) external pure returns (string memory stringifiedValue);
+
+    /// Converts the given value to a `string`.
+    function toString(int256 value) external pure returns (string memory stringifiedValue);
+
+    /// Converts the given `string` value to Uppercase.
+    function toUppercase(string calldata input) external pure returns (string memory output);
+
+    /// Trims leading and trailing whitespace from the given `string` value.
+    function trim(string calldata input) external pure returns (string memory output);
+}
+
+/// The `Vm` interface does allow manipulation of the EVM state. These are all intended to be used
+/// in tests, but it is not recommended to use these cheats in scripts.
+interface Vm is VmSafe {
+    // ======== EVM ========
+
+    /// Reads the current `msg.sender` and `tx.origin` from state and reports if there is any active caller modification.
+    function readCallers() external view returns (CallerMode callerMode, address msgSender, address txOrigin);
+
+    // ======== Utilities ========
+
+    /// Causes the next contract creation (via new) to fail and return its initcode in the returndata buffer.
+    /// This allows type-safe access to the initcode payload that would be used for contract creation.
+    /// Example usage:
+    /// vm.interceptInitcode();
+    /// bytes memory initcode;
+    /// try new MyContract(param1, param2) { assert(false); }
+    /// catch (bytes memory interceptedInitcode) { initcode = interceptedInitcode; }
+    function interceptInitcode() external;
+}
@@ -0,0 +1,933 @@
+# Tests for `vm.py`. Run with `python3 -m pytest scripts`.
+import functools
+import os
+import random
+import subprocess
+import sys
+
+import vm
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(SCRIPTS_DIR, "fixtures")
+# A subset of the cheatcodes in `src/Vm.sol`, and the interface generated from it. Every
+# declaration in `Vm.sol` is copied verbatim from `src/Vm.sol`, which is formatted by `forge fmt`.
+FIXTURE_SPEC = os.path.join(FIXTURES_DIR, "cheatcodes.json")
+FIXTURE_OUT = os.path.join(FIXTURES_DIR, "Vm.sol")
+
+
+def read_fixture_out() -> bytes:
+    with open(FIXTURE_OUT, "rb") as f:
+        return f.read()
+
+
+# The in-process layout must match `forge fmt` byte for byte, including wrapped declarations.
+def test_canonical_output_matches_golden():
+    artifacts = vm.generate(FIXTURE_SPEC)
+    assert artifacts[vm.OUT_PATH] == read_fixture_out()
+
+
+def test_no_external_fmt_cli_matches_golden(tmp_path):
+    res = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "vm.py"),
+            "--from",
+            FIXTURE_SPEC,
+            "--no-external-fmt",
+            "--cache-dir",
+            str(tmp_path / "cache"),
+        ],
+        cwd=tmp_path,
+        capture_output=True,
+    )
+    assert res.returncode == 0, res.stderr.decode()
+    assert (tmp_path / vm.OUT_PATH).read_bytes() == read_fixture_out()
+
+
+# Runs `vm.py` on the fixture in `tmp_path`, formatting in-process.
+def run_cli(tmp_path, *args: str) -> subprocess.CompletedProcess:
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, "vm.py"), "--from", FIXTURE_SPEC, "--no-external-fmt"]
+    cmd += ["--cache-dir", str(tmp_path / "cache"), *args]
+    return subprocess.run(cmd, cwd=tmp_path, capture_output=True, text=True)
+
+
+# A second run with the same input and options does nothing, and `--check` fails once the output
+# was edited by hand.
+def test_cli_skips_up_to_date_output(tmp_path):
+    out_path = tmp_path / vm.OUT_PATH
+    res = run_cli(tmp_path)
+    assert res.returncode == 0, res.stderr
+    assert f"Wrote to {vm.OUT_PATH}" in res.stdout
+
+    res = run_cli(tmp_path)
+    assert res.returncode == 0, res.stderr
+    assert res.stdout == f"{vm.OUT_PATH} is up to date\n"
+    res = run_cli(tmp_path, "--check")
+    assert (res.returncode, res.stdout) == (0, f"{vm.OUT_PATH} is up to date\n")
+
+    out_path.write_bytes(read_fixture_out().replace(b"function ", b"function  ", 1))
+    res = run_cli(tmp_path, "--check")
+    assert (res.returncode, res.stdout) == (1, f"{vm.OUT_PATH} is out of date\n")
+    assert out_path.read_bytes() != read_fixture_out()
+
+    res = run_cli(tmp_path)
+    assert res.returncode == 0, res.stderr
+    assert out_path.read_bytes() == read_fixture_out()
+    assert run_cli(tmp_path, "--check").returncode == 0
+
+
+# Regenerating unchanged content leaves `Vm.sol` untouched, so that forge doesn't recompile it.
+def test_cli_force_keeps_unchanged_output(tmp_path):
+    out_path = tmp_path / vm.OUT_PATH
+    assert run_cli(tmp_path).returncode == 0
+    os.utime(out_path, ns=(1_000_000_000, 1_000_000_000))
+    inode = os.stat(out_path).st_ino
+
+    res = run_cli(tmp_path, "--force")
+    assert res.returncode == 0, res.stderr
+    assert f"{vm.OUT_PATH} is unchanged" in res.stdout
+    assert os.stat(out_path).st_mtime_ns == 1_000_000_000
+    assert os.stat(out_path).st_ino == inode
+
+
+# The comparator `Vm.sol` used to be sorted with, before `cheatcode_sort_key`.
+def legacy_cmp_cheatcode(a: vm.Cheatcode, b: vm.Cheatcode) -> int:
+    if a.group != b.group:
+        return -1 if a.group < b.group else 1
+    if a.status != b.status:
+        return -1 if a.status < b.status else 1
+    if a.safety != b.safety:
+        return -1 if a.safety < b.safety else 1
+    if a.func.id != b.func.id:
+        return -1 if a.func.id < b.func.id else 1
+    return 0
+
+
+def legacy_partition(ccs: list[vm.Cheatcode]) -> tuple[list[vm.Cheatcode], list[vm.Cheatcode]]:
+    ccs = [cc for cc in ccs if cc.status not in ["experimental", "internal"]]
+    ccs.sort(key=lambda cc: cc.func.id)
+    safe = sorted([cc for cc in ccs if cc.safety == "safe"], key=functools.cmp_to_key(legacy_cmp_cheatcode))
+    unsafe = sorted([cc for cc in ccs if cc.safety == "unsafe"], key=functools.cmp_to_key(legacy_cmp_cheatcode))
+    return safe, unsafe
+
+
+# Random cheatcodes drawn from small pools, so that groups, statuses and ids collide often,
+# including fully equal keys whose relative order depends on sort stability.
+def random_cheatcodes(rng: random.Random, n: int) -> list[vm.Cheatcode]:
+    ccs = []
+    for i in range(n):
+        func = vm.Function(
+            rng.choice(["warp", "roll", "Roll", "roll_1", "rollFork", "_"]) + rng.choice(["", "0", "1"]),
+            f"#{i}",
+            "function f() external;",
+            vm.Visibility.EXTERNAL,
+            vm.Mutability.NONE,
+            "f()",
+            rng.getrandbits(32),
+        )
+        group = rng.choice(["evm", "Evm", "json", "testing", "fs"])
+        status = rng.choice(["stable", "deprecated", "removed", "experimental", "internal"])
+        ccs.append(vm.Cheatcode(func, group, status, rng.choice(["safe", "unsafe"])))
+    return ccs
+
+
+def test_partition_matches_legacy_comparator():
+    rng = random.Random(0x5eed)
+    for _ in range(500):
+        ccs = random_cheatcodes(rng, rng.randint(0, 200))
+        expected = legacy_partition(ccs)
+        actual = vm.partition_cheatcodes(ccs)
+        for e, a in zip(expected, actual):
+            assert [id(cc) for cc in a] == [id(cc) for cc in e]
+
+
+# `Function` and `Cheatcode` as they were before they were slotted: a `__dict__` per instance, the
+# selector as both a hex string and bytes, and a string object per categorical field.
+class LegacyFunction:
+    def __init__(self, d: dict):
+        self.id = d["id"]
+        self.description = d["description"]
+        self.declaration = d["declaration"]
+        self.visibility = vm.Visibility(d["visibility"])
+        self.mutability = vm.Mutability(d["mutability"])
+        self.signature = d["signature"]
+        self.selector = d["selector"]
+        self.selector_bytes = bytes(d["selectorBytes"])
+
+
+class LegacyCheatcode:
+    def __init__(self, d: dict):
+        self.func = LegacyFunction(d["func"])
+        self.group = str(d["group"])
+        self.status = str(d["status"])
+        self.safety = str(d["safety"])
+
+
+# Memory held by the models of a synthetic 100k-cheatcode spec, built from the fixture. The spec is
+# decoded from JSON text, so that every value is its own string object, as when loading a real file.
+def test_model_memory():
+    import json
+    import tracemalloc
+
+    with open(FIXTURE_SPEC) as f:
+        cheatcodes = json.load(f)["cheatcodes"]
+    synthetic = []
+    for i in range(100_000):
+        cc = cheatcodes[i % len(cheatcodes)]
+        synthetic.append(dict(cc, func=dict(cc["func"], id=f"{cc['func']['id']}_{i}")))
+    text = json.dumps(synthetic)
+
+    def measure(build) -> int:
+        ccs = json.loads(text)
+        tracemalloc.start()
+        try:
+            models = [build(cc) for cc in ccs]
+            size, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del models
+        return size
+
+    legacy = measure(LegacyCheatcode)
+    current = measure(vm.Cheatcode.from_dict)
+    print(f"100k cheatcodes: {legacy / 1e6:.1f} MB legacy, {current / 1e6:.1f} MB slotted")
+    assert current < 0.8 * legacy
+
+
+# What `JsonArrayStream` should yield for `doc`, computed with `json.loads`.
+def expected_array_items(doc: str) -> list[tuple[str, object]]:
+    import json
+
+    return [(k, v) for k, values in json.loads(doc).items() if isinstance(values, list) for v in values]
+
+
+# Chunks can split the document anywhere, including inside numbers (`1.` | `25`), literals and
+# multi-byte characters, so every chunk size must decode the same items.
+def test_json_array_stream_chunk_sizes():
+    import io
+    import json
+
+    docs = [
+        '{"version": 1.25, "a": [2.5, 10e2]}',
+        '{"a": [-0.5e-3, 123456789, -7, 0, 1E+2], "b": 3.0, "c": [true, false, null]}',
+        '{ "n" : [ 1 , 22 ,333 ] , "s": ["\\u00e9\\"", "日本", "\U0001f600"], "e": [] }',
+        json.dumps({"cheatcodes": [{"func": {"id": "warp", "selectorBytes": [230, 174, 160, 175]}, "x": -1.5}]}),
+    ]
+    rng = random.Random(5)
+    for _ in range(10):
+        values = [rng.choice([rng.randint(-10**6, 10**6), rng.uniform(-1e6, 1e6), rng.random() * 1e-9]) for _ in range(8)]
+        docs.append(json.dumps({"x": values, "y": rng.uniform(-1, 1), "z": [{"v": v} for v in values]}))
+
+    for doc in docs:
+        expected = expected_array_items(doc)
+        data = doc.encode()
+        for chunk_size in range(1, len(data) + 2):
+            assert list(vm.JsonArrayStream(io.BytesIO(data), chunk_size)) == expected, (doc, chunk_size)
+            assert list(vm.JsonArrayStream(io.StringIO(doc), chunk_size)) == expected, (doc, chunk_size)
+
+
+# Fragments rendered by one version of the script must not be reused by another one sharing the
+# same cache directory.
+def test_fragment_cache_is_keyed_by_generator(tmp_path):
+    with open(os.path.join(SCRIPTS_DIR, "vm.py")) as f:
+        src = f.read()
+    patched = src.replace('prefix = "/// " if doc', 'prefix = "///! " if doc')
+    assert patched != src
+    (tmp_path / "patched.py").write_text(patched)
+
+    def run(script: str, cwd, *args: str) -> bytes:
+        os.makedirs(cwd / "src", exist_ok=True)
+        cmd = [sys.executable, script, "--from", FIXTURE_SPEC, "--no-external-fmt", *args]
+        res = subprocess.run(cmd + ["--cache-dir", str(tmp_path / "cache")], cwd=cwd, capture_output=True)
+        assert res.returncode == 0, res.stderr.decode()
+        return (cwd / vm.OUT_PATH).read_bytes()
+
+    run(os.path.join(SCRIPTS_DIR, "vm.py"), tmp_path / "a")
+    cached = run(str(tmp_path / "patched.py"), tmp_path / "a")
+    uncached = run(str(tmp_path / "patched.py"), tmp_path / "b", "--no-render-cache")
+    assert b"///! " in uncached
+    assert cached == uncached
+
+
+# `--compare-profiles` must measure the whole interface, not just the text rendered after the last
+# intermediate `finish`.
+def test_compare_profiles_measures_whole_output():
+    contract = vm.Cheatcodes.from_json_file(FIXTURE_SPEC)
+    safe, unsafe = vm.partition_cheatcodes(contract.cheatcodes)
+    results = vm.compare_profiles(contract, safe, unsafe, vm.vm_printer_options(canonical=True))
+    assert [r["profile"] for r in results] == list(vm.PROFILES)
+    for r in results:
+        out = vm.generate(FIXTURE_SPEC, vm.GenerateOptions(profile=r["profile"]))[vm.OUT_PATH]
+        assert r["bytes"] == len(out)
+        assert r["lines"] == out.count(b"\n")
+    assert results[0]["bytes"] == len(read_fixture_out())
+
+
+# Files rewritten in place keep their mode, and new ones get the default mode for the umask instead
+# of the owner-only mode of temporary files.
+def test_written_files_keep_their_mode(tmp_path):
+    old_umask = os.umask(0o022)
+    try:
+        test_path = tmp_path / "Vm.t.sol"
+        test_path.write_text("assertEq(type(VmSafe).interfaceId, bytes4(0x00000000));\n")
+        os.chmod(test_path, 0o640)
+        assert vm.sync_test_interface_ids(str(test_path), {"VmSafe": 0x12345678}, update=True)
+        assert "bytes4(0x12345678)" in test_path.read_text()
+        assert os.stat(test_path).st_mode & 0o777 == 0o640
+
+        vm.write_atomic(str(tmp_path / "new.json"), b"{}")
+        assert os.stat(tmp_path / "new.json").st_mode & 0o777 == 0o644
+    finally:
+        os.umask(old_umask)
+
+    res = subprocess.run(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "vm.py"),
+            "--from",
+            FIXTURE_SPEC,
+            "--no-external-fmt",
+            "--cache-dir",
+            str(tmp_path / "cache"),
+        ],
+        cwd=tmp_path,
+        capture_output=True,
+        preexec_fn=lambda: os.umask(0o022),
+    )
+    assert res.returncode == 0, res.stderr.decode()
+    for path in (vm.OUT_PATH, vm.interface_ids_path(vm.OUT_PATH), vm.manifest_path(vm.OUT_PATH)):
+        assert os.stat(tmp_path / path).st_mode & 0o777 == 0o644, path
+
+
+# A `selector` that disagrees with `selectorBytes` is reported by `verify_selectors`, with every other
+# problem, instead of aborting the parse.
+def test_selector_mismatch_is_reported_by_verification():
+    import json
+
+    with open(FIXTURE_SPEC) as f:
+        spec = json.load(f)
+    spec["cheatcodes"][0]["func"]["selector"] = "0xdeadbeef"
+    spec["cheatcodes"][1]["func"]["selector"] = "not hex"
+    contract = vm.Cheatcodes.from_dict(spec)
+    safe, unsafe = vm.partition_cheatcodes(contract.cheatcodes)
+    problems = vm.verify_selectors(safe, unsafe)
+    assert len(problems) == 2
+    assert all("doesn't match selectorBytes" in p for p in problems)
+
+    # Snapshots keep the mismatch, so that verifying a loaded model still reports it.
+    data = vm.ModelSnapshot.encode(contract, safe, unsafe, verified=False)
+    _, safe, unsafe, _ = vm.ModelSnapshot.decode(data)
+    assert vm.verify_selectors(safe, unsafe) == problems
+
+
+# `serve` keeps regenerating while a client holds its connection open, and keeps answering it.
+def test_serve_regenerates_with_open_connection(tmp_path):
+    import json
+    import shutil
+    import signal
+    import socket
+    import time
+
+    spec_path = tmp_path / "cheatcodes.json"
+    shutil.copy(FIXTURE_SPEC, spec_path)
+    socket_path = tmp_path / "serve.sock"
+    proc = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.join(SCRIPTS_DIR, "vm.py"),
+            "serve",
+            "--from",
+            str(spec_path),
+            "--no-external-fmt",
+            "--socket",
+            str(socket_path),
+            "--cache-dir",
+            str(tmp_path / "cache"),
+            "--poll-interval",
+            "0.05",
+        ],
+        cwd=tmp_path,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    def wait_for(condition, timeout: float = 20.0):
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert proc.poll() is None, "serve exited"
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.02)
+
+    try:
+        wait_for(socket_path.exists)
+        out_path = tmp_path / vm.OUT_PATH
+        wait_for(out_path.exists)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(str(socket_path))
+            responses = client.makefile("rb")
+
+            def request(req: dict) -> dict:
+                client.sendall((json.dumps(req) + "\n").encode())
+                return json.loads(responses.readline())
+
+            before = request({"op": "interface_ids"})["ids"]
+            generated = out_path.read_bytes()
+
+            with open(spec_path) as f:
+                spec = json.load(f)
+            removed = next(cc for cc in spec["cheatcodes"] if cc["status"] == "stable")
+            spec["cheatcodes"].remove(removed)
+            tmp_spec = tmp_path / "cheatcodes.json.tmp"
+            tmp_spec.write_text(json.dumps(spec))
+            os.replace(tmp_spec, spec_path)
+
+            wait_for(lambda: out_path.read_bytes() != generated)
+            assert removed["func"]["declaration"].encode() in generated
+            assert removed["func"]["declaration"].encode() not in out_path.read_bytes()
+            after = request({"op": "interface_ids"})["ids"]
+            assert after != before
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=20)
+
+
+# The library API raises instead of asserting, so that broken specs are rejected under `python -O` too.
+def test_generate_rejects_broken_specs():
+    import json
+
+    import pytest
+
+    with open(FIXTURE_SPEC) as f:
+        spec = json.load(f)
+    bad_selector = json.loads(json.dumps(spec))
+    bad_selector["cheatcodes"][0]["func"]["selectorBytes"] = [0, 0, 0, 0]
+    bad_selector["cheatcodes"][0]["func"]["selector"] = "0x00000000"
+    with pytest.raises(ValueError, match="starts with"):
+        vm.generate(vm.Cheatcodes.from_dict(bad_selector))
+
+    # A signature, and selector, that don't match the declaration are only caught by the ABI check.
+    bad_abi = json.loads(json.dumps(spec))
+    func = bad_abi["cheatcodes"][0]["func"]
+    func["signature"] = "notTheDeclaredFunction()"
+    selector = vm.keccak256(func["signature"].encode())[:4]
+    func["selector"] = "0x" + selector.hex()
+    func["selectorBytes"] = list(selector)
+    contract = vm.Cheatcodes.from_dict(bad_abi)
+    vm.generate(contract)
+    with pytest.raises(ValueError, match="the ABI built from its declaration"):
+        vm.generate(contract, vm.GenerateOptions(abi_dir="abi"))
+
+    with pytest.raises(ValueError, match="unknown options: bogus"):
+        vm.GenerateOptions.from_dict({"bogus": True})
+
+
+def test_batch(tmp_path):
+    import json
+
+    batch = [
+        {"input": FIXTURE_SPEC, "output": "full/Vm.sol"},
+        {"input": FIXTURE_SPEC, "output": "compact/Vm.sol", "profile": "compact", "split": True},
+    ]
+    (tmp_path / "batch.json").write_text(json.dumps(batch))
+    script = os.path.join(SCRIPTS_DIR, "vm.py")
+    cmd = [sys.executable, script, "batch", "--batch-file", "batch.json", "--cache-dir", str(tmp_path / "cache")]
+    res = subprocess.run(cmd, cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    assert (tmp_path / "full" / "Vm.sol").read_bytes() == read_fixture_out()
+    assert (tmp_path / "compact" / "vm" / "Crypto.sol").exists()
+
+    # Options that only the batch file can set are rejected on the command line.
+    res = subprocess.run(cmd + ["--profile", "compact"], cwd=tmp_path, capture_output=True)
+    assert res.returncode == 2
+    assert b"takes its options from --batch-file" in res.stderr
+
+
+# Snapshots round-trip the model, and a payload whose fields have the wrong types is rejected even
+# when its digest is valid.
+def test_snapshot_rejects_mistyped_fields():
+    import hashlib
+    import json
+
+    contract = vm.Cheatcodes.from_json_file(FIXTURE_SPEC)
+    safe, unsafe = vm.partition_cheatcodes(contract.cheatcodes)
+    data = vm.ModelSnapshot.encode(contract, safe, unsafe, verified=True)
+    loaded, loaded_safe, loaded_unsafe, verified = vm.ModelSnapshot.decode(data)
+    assert verified is True
+    options = vm.vm_printer_options(canonical=True)
+    assert vm.render_vm(loaded, loaded_safe, loaded_unsafe, options) == vm.render_vm(contract, safe, unsafe, options)
+
+    header = vm.ModelSnapshot.HEADER
+    model = json.loads(data[header.size:])
+
+    def reencode(model) -> bytes:
+        payload = json.dumps(model).encode()
+        digest = hashlib.sha256(payload).digest()
+        return header.pack(vm.ModelSnapshot.MAGIC, vm.ModelSnapshot.VERSION, digest) + payload
+
+    assert vm.ModelSnapshot.decode(reencode(model)) is not None
+    tampered = [
+        lambda m: m[4][0].__setitem__(0, 1),  # `Function.id`
+        lambda m: m[4][0].__setitem__(6, "0x1234"),  # the selector
+        lambda m: m[4][0].__setitem__(6, True),
+        lambda m: m[4][0].__setitem__(7, 0),  # `selector_error`
+        lambda m: m[4][0].__setitem__(3, "hidden"),  # the visibility
+        lambda m: m[4][0].pop(),
+        lambda m: m[3][0][2][0].__setitem__(1, None),  # a struct field's type
+        lambda m: m[2][0].__setitem__(2, {}),  # an enum's variants
+        lambda m: m[0].append("error"),
+        lambda m: m[5].append(len(m[4])),  # a safe cheatcode's index
+        lambda m: m[6].append(-1),
+        lambda m: m.__setitem__(7, 1),  # `verified`
+        lambda m: m.pop(),
+    ]
+    for i, tamper in enumerate(tampered):
+        m = json.loads(json.dumps(model))
+        tamper(m)
+        assert vm.ModelSnapshot.decode(reencode(m)) is None, i
+    assert vm.ModelSnapshot.decode(reencode({})) is None
+    assert vm.ModelSnapshot.decode(data[:-1]) is None
+
+
+# Parallel rendering reads and fills the fragment cache under the same keys as serial rendering, so
+# that switching `--jobs` neither changes the output nor drops cached fragments.
+def test_parallel_rendering_shares_the_fragment_cache():
+    import concurrent.futures
+
+    contract = vm.Cheatcodes.from_json_file(FIXTURE_SPEC)
+    safe, unsafe = vm.partition_cheatcodes(contract.cheatcodes)
+    expected = read_fixture_out().decode()
+    cache = vm.FragmentCache(None)
+    with concurrent.futures.ProcessPoolExecutor(2) as executor:
+        options = vm.vm_printer_options(fragment_cache=cache, executor=executor, jobs=2)
+        assert vm.render_vm(contract, safe, unsafe, options) == expected
+        misses = cache.misses
+        assert misses >= len(contract.cheatcodes)
+        assert vm.render_vm(contract, safe, unsafe, options) == expected
+    assert cache.misses == misses
+    assert vm.render_vm(contract, safe, unsafe, vm.vm_printer_options(fragment_cache=cache)) == expected
+    assert cache.misses == misses
+    assert cache.hits >= 2 * len(contract.cheatcodes)
+
+
+def test_jobs_benchmark(capsys):
+    vm.print_jobs_benchmark(FIXTURE_SPEC, vm.DEFAULT_FILTER, [1, 2], functions=200, runs=1)
+    lines = capsys.readouterr().out.splitlines()
+    assert int(lines[0].split()[0]) >= 200
+    assert [line.split()[0] for line in lines[2:]] == ["1", "2"]
+
+
+# A minimal ABI encoder for the `CalldataDecoder` tests, following the same `{"type", "components"}`
+# entries as `abi_decoder`.
+def abi_encode(entry: dict, value) -> bytes:
+    ty = entry["type"]
+    if ty.endswith("]"):
+        i = ty.rindex("[")
+        element = dict(entry, type=ty[:i])
+        body = abi_encode_sequence([element] * len(value), value)
+        return body if ty[i + 1:-1] else len(value).to_bytes(32, "big") + body
+    if ty == "tuple":
+        return abi_encode_sequence(entry["components"], value)
+    if ty in ("bytes", "string"):
+        data = value.encode() if ty == "string" else value
+        return len(data).to_bytes(32, "big") + data + bytes(-len(data) % 32)
+    if ty.startswith("uint"):
+        return value.to_bytes(32, "big")
+    if ty.startswith("int"):
+        return value.to_bytes(32, "big", signed=True)
+    if ty == "address":
+        return bytes.fromhex(value.removeprefix("0x")).rjust(32, b"\0")
+    if ty == "bool":
+        return int(value).to_bytes(32, "big")
+    assert ty.startswith("bytes"), ty
+    return value.ljust(32, b"\0")
+
+
+def abi_is_dynamic(entry: dict) -> bool:
+    ty = entry["type"]
+    if ty.endswith("[]") or ty in ("bytes", "string"):
+        return True
+    if ty.endswith("]"):
+        return abi_is_dynamic(dict(entry, type=ty[:ty.rindex("[")]))
+    return ty == "tuple" and any(abi_is_dynamic(c) for c in entry["components"])
+
+
+def abi_encode_sequence(entries: list[dict], values) -> bytes:
+    encoded = [abi_encode(e, v) for e, v in zip(entries, values)]
+    head_size = sum(32 if abi_is_dynamic(e) else len(data) for e, data in zip(entries, encoded))
+    head, tail = b"", b""
+    for e, data in zip(entries, encoded):
+        if abi_is_dynamic(e):
+            head += (head_size + len(tail)).to_bytes(32, "big")
+            tail += data
+        else:
+            head += data
+    return head + tail
+
+
+def abi_call(selector: int, inputs: list[dict], args) -> bytes:
+    return selector.to_bytes(4, "big") + abi_encode({"type": "tuple", "components": inputs}, args)
+
+
+# Nested tuples, dynamic and fixed arrays, `bytes` and `string` decode back to the encoded values.
+def test_calldata_decoder_round_trips():
+    point = {"type": "tuple", "components": [{"type": "address"}, {"type": "bytes"}, {"type": "int256[2]"}]}
+    calls = [
+        (
+            [{"type": "uint256"}, {"type": "string"}, dict(point, type="tuple[]")],
+            (2**256 - 1, "héllo", [("0x" + "11" * 20, b"\x01\x02", [-1, 7]), ("0x" + "00" * 19 + "ff", b"", [0, 0])]),
+        ),
+        (
+            [{"type": "string[2]"}, {"type": "uint8[3]"}, {"type": "bytes[][]"}, {"type": "bytes32"}],
+            (["a" * 40, ""], [1, 2, 3], [[b"x" * 33], [], [b"", b"yz"]], b"\xab" * 32),
+        ),
+        (
+            [{"type": "tuple", "components": [point, {"type": "bool"}, {"type": "uint256[][2]"}]}, {"type": "bytes4"}],
+            ((("0x" + "22" * 20, b"\xff" * 64, [2**255 - 1, -(2**255)]), True, [[1], [2, 3]]), b"\xde\xad\xbe\xef"),
+        ),
+        ([], ()),
+    ]
+    decoder = vm.CalldataDecoder({i: (f"f{i}", inputs) for i, (inputs, _) in enumerate(calls)})
+    for i, (inputs, args) in enumerate(calls):
+        assert decoder.decode(abi_call(i, inputs, args)) == (i, f"f{i}", args)
+
+    assert decoder.decode(b"\x00\x00") == (None, None, None)
+    assert decoder.decode(abi_call(len(calls), [], ())) == (len(calls), None, None)
+
+
+# Calldata cut short anywhere decodes with `args=None`. The encoding has no padding, so that every
+# byte is needed.
+def test_calldata_decoder_rejects_truncated_calldata():
+    inputs = [{"type": "uint256"}, {"type": "string"}, {"type": "bytes32[2]"}, {"type": "address[]"}]
+    data = abi_call(1, inputs, (5, "s" * 32, [b"\x01" * 32, b"\x02" * 32], ["0x" + "33" * 20]))
+    decoder = vm.CalldataDecoder({1: ("f", inputs)})
+    assert decoder.decode(data)[2] is not None
+    for end in range(4, len(data)):
+        assert decoder.decode(data[:end]) == (1, "f", None), end
+
+
+# Decoding in a process pool yields the same results, in input order, as decoding serially.
+def test_calldata_decode_stream_keeps_order():
+    inputs = [{"type": "uint256"}, {"type": "string"}]
+    decoder = vm.CalldataDecoder({1: ("f", inputs)})
+    items = []
+    for i in range(50):
+        if i % 7 == 0:
+            items.append(abi_call(2, [], ()))
+        elif i % 11 == 0:
+            items.append(abi_call(1, inputs, (i, str(i)))[:-40])
+        else:
+            items.append(abi_call(1, inputs, (i, str(i) * i)))
+    expected = [decoder.decode(data) for data in items]
+    assert list(decoder.decode_stream(iter(items), batch_size=4)) == expected
+    assert list(decoder.decode_stream(iter(items), batch_size=4, jobs=2)) == expected
+
+
+# The calldata of a `forge script` broadcast log, decoded with the signatures it records.
+def test_broadcast_calldata():
+    import json
+
+    path = os.path.join(SCRIPTS_DIR, "..", "test", "fixtures", "broadcast.log.json")
+    with open(path, "rb") as f:
+        calldata = list(vm.iter_broadcast_calldata(f))
+    with open(path) as f:
+        transactions = json.load(f)["transactions"]
+    assert calldata == [bytes.fromhex(tx["tx"]["data"].removeprefix("0x")) for tx in transactions]
+
+    functions = {}
+    for tx in transactions:
+        signature = tx["function"].split(":")[0]
+        params = signature[signature.index("(") + 1:-1]
+        selector = int.from_bytes(vm.keccak256(signature.encode())[:4], "big")
+        functions[selector] = (signature, [{"type": ty} for ty in params.split(",") if ty])
+    decoded = list(vm.CalldataDecoder(functions).decode_stream(calldata))
+    assert [(signature, args) for _, signature, args in decoded] == [
+        ("multiple_arguments(uint256,address,uint256[])", (1, "0x" + "00" * 18 + "1337", [3, 4])),
+        ("inc()", ()),
+        ("t(uint256)", (1,)),
+    ]
+
+
+def test_selector_database(tmp_path):
+    contract = vm.Cheatcodes.from_json_file(FIXTURE_SPEC)
+    safe, unsafe = vm.partition_cheatcodes(contract.cheatcodes)
+    artifacts = vm.generate(contract, vm.GenerateOptions(selector_db="selectors.db"))
+    (tmp_path / "selectors.db").write_bytes(artifacts["selectors.db"])
+    with vm.SelectorDatabase(str(tmp_path / "selectors.db")) as db:
+        assert len(db) == len(safe + unsafe)
+        for cc in safe + unsafe:
+            func = cc.func
+            selector = func.selector_int.to_bytes(4, "big")
+            assert db.lookup(func.selector_int) == (func.signature, cc.group, cc.safety, func.declaration)
+            assert db.lookup(selector) == db.lookup(func.selector_int)
+            assert db.signature(func.selector_int) == func.signature
+            # Calldata: the selector followed by the arguments.
+            assert db.signature(selector + bytes(64)) == func.signature
+            assert func.selector_int in db
+            assert selector + b"\x01" in db
+
+        selectors = {cc.func.selector_int for cc in safe + unsafe}
+        missing = next(s for s in range(2**32) if s not in selectors)
+        assert missing not in db
+        assert missing.to_bytes(4, "big") not in db
+        assert 0xFFFFFFFF not in db
+        assert db.lookup(missing) is None
+        assert db.signature(missing) is None
+        assert db.signature(missing.to_bytes(4, "big")) is None
+
+
+# Types that are neither elementary nor declared by the spec can't be turned into an ABI.
+def test_abi_rejects_unknown_types():
+    import json
+
+    import pytest
+
+    with open(FIXTURE_SPEC) as f:
+        spec = json.load(f)
+    spec["structs"] = [s for s in spec["structs"] if s["name"] != "Wallet"]
+    contract = vm.Cheatcodes.from_dict(spec)
+    with pytest.raises(ValueError, match="unknown type `Wallet`"):
+        vm.generate(contract, vm.GenerateOptions(abi_dir="abi"))
+
+
+# The ABIs of the fixture, as solc emits them: structs as tuples with `components` and a
+# `struct VmSafe.X` internal type, enums as `uint8`, and the state mutability of each function.
+def test_abis_match_golden():
+    import json
+
+    artifacts = vm.generate(FIXTURE_SPEC, vm.GenerateOptions(abi_dir="abi"))
+    for name in ("Vm", "VmSafe"):
+        with open(os.path.join(FIXTURES_DIR, f"{name}.abi.json"), "rb") as f:
+            assert artifacts[f"abi/{name}.abi.json"] == f.read(), name
+
+    abi = {entry["name"]: entry for entry in json.loads(artifacts["abi/Vm.abi.json"])}
+    assert abi["readCallers"]["stateMutability"] == "view"
+    assert abi["readCallers"]["outputs"][0] == {
+        "internalType": "enum VmSafe.CallerMode",
+        "name": "callerMode",
+        "type": "uint8",
+    }
+    accesses = abi["stopAndReturnStateDiff"]["outputs"][0]
+    assert (accesses["type"], accesses["internalType"]) == ("tuple[]", "struct VmSafe.AccountAccess[]")
+    components = {c["name"]: c for c in accesses["components"]}
+    assert components["chainInfo"]["internalType"] == "struct VmSafe.ChainInfo"
+    assert [c["type"] for c in components["chainInfo"]["components"]] == ["uint256", "uint256"]
+    assert components["kind"] == {"internalType": "enum VmSafe.AccountAccessKind", "name": "kind", "type": "uint8"}
+    assert components["storageAccesses"]["type"] == "tuple[]"
+    assert {entry["stateMutability"] for entry in abi.values()} == {"nonpayable", "pure", "view"}
+
+
+# Splitting the interfaces into one per group keeps the IDs of `Vm` and `VmSafe`. Each group's
+# interface ID is the XOR of its selectors, so together they make up the ID of the whole interface.
+def test_split_keeps_interface_ids():
+    contract = vm.Cheatcodes.from_json_file(FIXTURE_SPEC)
+    safe, unsafe = vm.partition_cheatcodes(contract.cheatcodes)
+    ids = vm.interface_ids(safe, unsafe)
+    split_ids = vm.interface_ids(safe, unsafe, split=True)
+    assert split_ids["Vm"] == ids["Vm"]
+    assert split_ids["VmSafe"] == ids["VmSafe"]
+    for prefix, cheats in (("VmSafe", safe), ("Vm", unsafe)):
+        groups = {prefix + vm.group_title(cc.group) for cc in cheats}
+        combined = 0
+        for name in groups:
+            combined ^= split_ids[name]
+        assert combined == ids[prefix]
+
+
+# A run without `--split` removes the per-group interfaces left by a previous `--split` run, and
+# keeps files it didn't generate.
+def test_unsplit_run_removes_split_outputs(tmp_path):
+    os.makedirs(tmp_path / "src")
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, "vm.py"), "--from", FIXTURE_SPEC, "--no-external-fmt"]
+    cmd += ["--cache-dir", str(tmp_path / "cache")]
+    split_dir = tmp_path / "src" / vm.SPLIT_DIR
+    res = subprocess.run(cmd + ["--split"], cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    assert (split_dir / "VmTypes.sol").exists()
+
+    res = subprocess.run(cmd, cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    assert not split_dir.exists()
+    assert (tmp_path / vm.OUT_PATH).read_bytes() == read_fixture_out()
+
+    res = subprocess.run(cmd + ["--split"], cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    (split_dir / "Mine.sol").write_text("// Not generated.\n")
+    res = subprocess.run(cmd, cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    assert os.listdir(split_dir) == ["Mine.sol"]
+
+
+# `--prune-to` keeps the cheatcodes a project calls, with all their overloads, and the types they
+# reference, directly or through struct fields. `Vm` is left without items, and is emitted as `{}`
+# like `forge fmt` does.
+def test_prune_to_project_usage(tmp_path):
+    project = tmp_path / "project"
+    os.makedirs(project / "test")
+    os.makedirs(project / ".hidden")
+    (project / "test" / "A.t.sol").write_text(
+        "contract A {\n"
+        "    function test() public {\n"
+        "        Vm.Wallet memory w = vm.createWallet(1);\n"
+        "        vm . sign(w, bytes32(0));\n"
+        "        cheats.readCallers();\n"
+        "        vm.stopAndReturnStateDiff();\n"
+        "        vm.notACheatcode();\n"
+        "    }\n"
+        "}\n"
+    )
+    (project / ".hidden" / "B.sol").write_text("contract B { function f() public { vm.toString(1); } }\n")
+    os.makedirs(tmp_path / "src")
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, "vm.py"), "--from", FIXTURE_SPEC, "--no-external-fmt"]
+    cmd += ["--cache-dir", str(tmp_path / "cache"), "--prune-to", str(project)]
+    res = subprocess.run(cmd, cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    assert b"ignoring unknown cheatcodes: notACheatcode" in res.stderr
+    out = (tmp_path / vm.OUT_PATH).read_text()
+
+    contract = vm.Cheatcodes.from_json_file(FIXTURE_SPEC)
+    safe, unsafe = vm.partition_cheatcodes(contract.cheatcodes)
+    kept = {"createWallet", "sign", "stopAndReturnStateDiff"}
+    for cc in safe + unsafe:
+        assert (cc.func.declaration in out) == (cc.func.signature.split("(")[0] in kept), cc.func.signature
+    for ty in ("struct Wallet", "struct AccountAccess", "struct StorageAccess", "struct ChainInfo"):
+        assert ty + " {" in out
+    assert "enum AccountAccessKind {" in out
+    assert "CallerMode" not in out
+    assert "SignedDelegation" not in out
+    assert out.endswith("interface Vm is VmSafe {}\n")
+
+    res = subprocess.run(cmd + ["--prune-receivers", "vm,cheats"], cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    out = (tmp_path / vm.OUT_PATH).read_text()
+    assert "function readCallers()" in out
+    assert "enum CallerMode {" in out
+    assert not out.endswith("{}\n")
+
+
+# An explicit `--status` allowlist replaces the default denylist of experimental and internal
+# cheatcodes, instead of being silently emptied by it. Listing a status in both is a usage error.
+def test_status_allowlist_overrides_default_exclusions(tmp_path):
+    assert vm.CheatcodeFilter().exclude_statuses == vm.EXCLUDED_STATUSES
+    assert vm.CheatcodeFilter(statuses=frozenset(["experimental"])).accepts("crypto", "experimental", "safe")
+    assert not vm.CheatcodeFilter.from_dict({"statuses": ["stable"]}).accepts("crypto", "experimental", "safe")
+    assert vm.CheatcodeFilter.from_dict({"statuses": ["experimental"]}).accepts("crypto", "experimental", "safe")
+
+    contract = vm.Cheatcodes.from_json_file(FIXTURE_SPEC)
+    experimental = [cc for cc in contract.cheatcodes if cc.status == "experimental"]
+    assert experimental
+    os.makedirs(tmp_path / "src")
+    cmd = [sys.executable, os.path.join(SCRIPTS_DIR, "vm.py"), "--from", FIXTURE_SPEC, "--no-external-fmt"]
+    cmd += ["--cache-dir", str(tmp_path / "cache")]
+    res = subprocess.run(cmd + ["--status", "experimental"], cwd=tmp_path, capture_output=True)
+    assert res.returncode == 0, res.stderr.decode()
+    out = (tmp_path / vm.OUT_PATH).read_text()
+    assert out.count("    function ") == len(experimental)
+
+    overlap = ["--status", "stable,internal", "--exclude-status", "internal"]
+    res = subprocess.run(cmd + overlap, cwd=tmp_path, capture_output=True)
+    assert res.returncode == 2
+    assert b"--status and --exclude-status both list internal" in res.stderr
+
+
+# `SpecCache` against a local server: the first fetch downloads the spec, later ones send its `ETag`
+# and reuse the cached copy on `304 Not Modified`, gzip bodies are stored decompressed, and the last
+# good copy is used offline or when the server is unreachable.
+def test_spec_cache_fetch(tmp_path, capsys):
+    import gzip
+    import http.server
+    import threading
+    import urllib.error
+
+    import pytest
+
+    served = {"body": b'{"version": 1}', "etag": '"v1"', "gzip": False}
+    requests = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(dict(self.headers))
+            if self.headers.get("If-None-Match") == served["etag"]:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = served["body"]
+            self.send_response(200)
+            self.send_header("ETag", served["etag"])
+            if served["gzip"]:
+                assert "gzip" in self.headers.get("Accept-Encoding", "")
+                body = gzip.compress(body)
+                self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/cheatcodes.json"
+    cache = vm.SpecCache(str(tmp_path / "cache"))
+    try:
+        first = cache.fetch(url, timeout=5)
+        assert open(first, "rb").read() == served["body"]
+        assert "If-None-Match" not in requests[-1]
+
+        assert cache.fetch(url, timeout=5) == first
+        assert requests[-1]["If-None-Match"] == '"v1"'
+        assert len(os.listdir(tmp_path / "cache" / "objects")) == 1
+
+        served.update(body=b'{"version": 2}' * 100, etag='"v2"', gzip=True)
+        second = cache.fetch(url, timeout=5)
+        assert second != first
+        assert open(second, "rb").read() == served["body"]
+        assert requests[-1]["If-None-Match"] == '"v1"'
+
+        count = len(requests)
+        assert cache.fetch(url, offline=True) == second
+        assert len(requests) == count
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert cache.fetch(url, timeout=5) == second
+    assert "using cached copy" in capsys.readouterr().err
+    with pytest.raises(urllib.error.URLError):
+        vm.SpecCache(str(tmp_path / "empty")).fetch(url, timeout=5)
+
+
+# Projects sharing a cache directory get their own default `serve` socket. Usage errors are reported
+# by argparse, also under `python -O`.
+def test_serve_socket_per_project(tmp_path):
+    import signal
+    import time
+
+    script = os.path.join(SCRIPTS_DIR, "vm.py")
+    cache_dir = str(tmp_path / "cache")
+    procs = []
+    try:
+        cmd = [sys.executable, script, "serve", "--from", FIXTURE_SPEC, "--no-external-fmt", "--cache-dir", cache_dir]
+        for project in ("a", "b"):
+            os.makedirs(tmp_path / project / "src")
+            cwd = tmp_path / project
+            procs.append(subprocess.Popen(cmd, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE))
+        sockets = [
+            os.path.join(cache_dir, "serve", vm.output_key(str(tmp_path / project / vm.OUT_PATH)) + ".sock")
+            for project in ("a", "b")
+        ]
+        deadline = time.monotonic() + 20
+        while not all(os.path.exists(path) for path in sockets):
+            assert all(proc.poll() is None for proc in procs), [proc.stderr.read() for proc in procs if proc.poll()]
+            assert time.monotonic() < deadline, "timed out"
+            time.sleep(0.02)
+    finally:
+        for proc in procs:
+            proc.send_signal(signal.SIGTERM)
+            proc.wait(timeout=20)
+            proc.stderr.close()
+
+    for args in (["watch"], ["serve", "--from", FIXTURE_SPEC, "--check"]):
+        res = subprocess.run([sys.executable, "-O", script, *args], cwd=tmp_path, capture_output=True)
+        assert res.returncode == 2, res.stderr.decode()
+        assert b"usage:" in res.stderr
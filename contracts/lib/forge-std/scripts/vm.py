@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 
-import argparse
-import copy
+# `argparse`, `concurrent.futures` and `urllib.request` are imported where they are used: they make up
+# most of the time it takes to import this script, which tools using it as a library pay on every run.
+import codecs
+import filecmp
+import functools
+import hashlib
+import io
 import json
+import mmap
+import operator
+import os
 import re
+import shutil
+import stat
+import struct
 import subprocess
+import sys
+import tempfile
+import time
+import zlib
+from bisect import bisect_left
 from enum import Enum as PyEnum
-from pathlib import Path
-from typing import Callable
-from urllib import request
+from typing import Callable, Iterator
 
 VoidFn = Callable[[], None]
 
 CHEATCODES_JSON_URL = "https://raw.githubusercontent.com/foundry-rs/foundry/master/crates/cheatcodes/assets/cheatcodes.json"
 OUT_PATH = "src/Vm.sol"
+TEST_PATH = "test/Vm.t.sol"
 
 VM_SAFE_DOC = """\
 /// The `VmSafe` interface does not allow manipulation of the EVM state or other actions that may
@@ -28,45 +43,428 @@ VM_DOC = """\
 
 
 def main():
+    import argparse
+
     parser = argparse.ArgumentParser(
             description="Generate Vm.sol based on the cheatcodes json created by Foundry")
+    parser.add_argument(
+            "mode",
+            nargs="?",
+            choices=["generate", "watch", "serve", "batch"],
+            default="generate",
+            help="generate: write the output once; watch: keep running, and regenerate whenever the "
+                 "`--from` file changes; serve: watch, and also answer requests on `--socket`; batch: "
+                 "run the jobs of `--batch-file` in one process (default: %(default)s)")
     parser.add_argument(
             "--from",
             metavar="PATH",
             dest="path",
             required=False,
             help="path to a json file containing the Vm interface, as generated by Foundry")
+    parser.add_argument(
+            "--groups",
+            metavar="GROUPS",
+            type=comma_set,
+            help="comma-separated list of cheatcode groups to include (default: all)")
+    parser.add_argument(
+            "--exclude-groups",
+            metavar="GROUPS",
+            type=comma_set,
+            default=frozenset(),
+            help="comma-separated list of cheatcode groups to exclude")
+    parser.add_argument(
+            "--status",
+            metavar="STATUSES",
+            type=comma_set,
+            help="comma-separated list of cheatcode statuses to include (default: all)")
+    parser.add_argument(
+            "--exclude-status",
+            metavar="STATUSES",
+            type=comma_set,
+            help="comma-separated list of cheatcode statuses to exclude (default: experimental,internal, or none "
+                 "with --status)")
+    parser.add_argument(
+            "--safety",
+            metavar="SAFETY",
+            type=comma_set,
+            help="comma-separated list of safety levels to include, `safe` and/or `unsafe` (default: all)")
+    parser.add_argument(
+            "--url",
+            default=CHEATCODES_JSON_URL,
+            help="URL to download the cheatcodes json from when --from is not given")
+    parser.add_argument(
+            "--cache-dir",
+            metavar="PATH",
+            default=default_cache_dir(),
+            help="directory used to cache downloaded cheatcodes json (default: %(default)s)")
+    parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="always download the cheatcodes json and do not store it in the cache")
+    parser.add_argument(
+            "--offline",
+            action="store_true",
+            help="do not access the network, use the last cached cheatcodes json instead")
+    parser.add_argument(
+            "--timeout",
+            type=float,
+            default=30.0,
+            help="network timeout in seconds (default: %(default)s)")
+    parser.add_argument(
+            "--force",
+            action="store_true",
+            help="regenerate even if the build manifest says the output is up to date")
+    parser.add_argument(
+            "--check",
+            action="store_true",
+            help="only check whether the output is up to date, exiting with 1 if it is not")
+    parser.add_argument(
+            "--no-external-fmt",
+            dest="external_fmt",
+            action="store_false",
+            help="lay out the output like `forge fmt` in-process instead of running `forge fmt`")
+    parser.add_argument(
+            "--no-fmt-cache",
+            dest="fmt_cache",
+            action="store_false",
+            help="always run `forge fmt` instead of reusing previously formatted output")
+    parser.add_argument(
+            "--fmt-cache-size",
+            metavar="BYTES",
+            type=int,
+            default=FmtCache.DEFAULT_MAX_BYTES,
+            help="maximum size of the `forge fmt` output cache (default: %(default)s)")
+    parser.add_argument(
+            "--no-render-cache",
+            dest="render_cache",
+            action="store_false",
+            help="render every item instead of reusing fragments rendered by previous runs")
+    parser.add_argument(
+            "--jobs",
+            "-j",
+            metavar="N",
+            type=int,
+            default=1,
+            help="number of processes used to render cheatcode groups in parallel (default: %(default)s)")
+    parser.add_argument(
+            "--split",
+            action="store_true",
+            help=f"write one interface per cheatcode group into `{SPLIT_DIR}/` next to the output, "
+                 "and make the output an aggregator that inherits from all of them")
+    parser.add_argument(
+            "--prune-to",
+            metavar="PATH",
+            nargs="+",
+            help="only emit the cheatcodes called as `vm.<name>(` in the .sol files under these paths, "
+                 "and the types they use. Include forge-std's own `src` if the project uses it")
+    parser.add_argument(
+            "--prune-receivers",
+            metavar="NAMES",
+            type=comma_set,
+            default=frozenset(["vm"]),
+            help="comma-separated names of the variables cheatcodes are called on (default: vm)")
+    parser.add_argument(
+            "--profile",
+            choices=list(PROFILES),
+            default="full",
+            help="full: all comments; summary: first line of doc comments only; compact: no comments "
+                 "(default: %(default)s)")
+    parser.add_argument(
+            "--compare-profiles",
+            action="store_true",
+            help="print the size of the output, and its solc parse time if solc is installed, for every "
+                 "profile, instead of writing it")
+    parser.add_argument(
+            "--test-ids",
+            choices=["verify", "update"],
+            help=f"verify, or update, the interface IDs asserted in `{TEST_PATH}` against the ones "
+                 "computed from the selectors. Runs even if the output is up to date")
+    parser.add_argument(
+            "--no-verify-selectors",
+            dest="verify_selectors",
+            action="store_false",
+            help="don't recompute the selectors from the signatures or check them for collisions")
+    parser.add_argument(
+            "--abi-dir",
+            metavar="DIR",
+            help="also write the ABI of `Vm` and `VmSafe` to `Vm.abi.json` and `VmSafe.abi.json` in DIR, "
+                 "built from the declarations and checked against the selectors")
+    parser.add_argument(
+            "--selector-db",
+            metavar="PATH",
+            help="also write a binary selector database to PATH, for fast selector lookups with "
+                 "`SelectorDatabase`")
+    parser.add_argument(
+            "--no-snapshot",
+            dest="snapshot",
+            action="store_false",
+            help="always parse the cheatcodes json instead of loading the model saved by a previous run")
+    parser.add_argument(
+            "--bench-snapshot",
+            action="store_true",
+            help="print how long parsing the cheatcodes json takes, compared to loading a snapshot of the "
+                 "model, instead of writing the output")
+    parser.add_argument(
+            "--bench-jobs",
+            metavar="N,N,...",
+            type=comma_ints,
+            help="print how long rendering the functions of a synthetic spec, made of copies of the input's "
+                 "cheatcodes, takes with each number of workers, e.g. 1,2,4,8, instead of writing the output")
+    parser.add_argument(
+            "--socket",
+            metavar="PATH",
+            help="Unix socket `serve` listens on (default: a socket in the cache directory, named after the "
+                 "absolute path of the output, so that each project gets its own)")
+    parser.add_argument(
+            "--poll-interval",
+            metavar="SECONDS",
+            type=float,
+            default=0.2,
+            help="how often `watch` and `serve` check the `--from` file when inotify isn't available "
+                 "(default: %(default)s)")
+    parser.add_argument(
+            "--batch-file",
+            metavar="PATH",
+            help="json list of the jobs `batch` runs, as objects with an `input` json, an `output` path and "
+                 "options: `filter`, `profile`, `split`, `prune`, `abi_dir`, `selector_db`, `verify_selectors`. "
+                 "Jobs are always formatted in-process, and the only other options `batch` takes are --jobs, "
+                 "--cache-dir, --no-cache and --no-snapshot")
     args = parser.parse_args()
-    json_str = request.urlopen(CHEATCODES_JSON_URL).read().decode("utf-8") if args.path is None else Path(args.path).read_text()
-    contract = Cheatcodes.from_json(json_str)
-
-    ccs = contract.cheatcodes
-    ccs = list(filter(lambda cc: cc.status not in ["experimental", "internal"], ccs))
-    ccs.sort(key=lambda cc: cc.func.id)
-
-    safe = list(filter(lambda cc: cc.safety == "safe", ccs))
-    safe.sort(key=CmpCheatcode)
-    unsafe = list(filter(lambda cc: cc.safety == "unsafe", ccs))
-    unsafe.sort(key=CmpCheatcode)
-    assert len(safe) + len(unsafe) == len(ccs)
+    if args.jobs < 1 or any(n < 1 for n in args.bench_jobs or []):
+        parser.error("--jobs and --bench-jobs must be at least 1")
+    if args.status is not None and args.exclude_status is not None and args.status & args.exclude_status:
+        parser.error(f"--status and --exclude-status both list {', '.join(sorted(args.status & args.exclude_status))}")
+    if (args.mode == "batch") != (args.batch_file is not None):
+        parser.error("`batch` requires --batch-file, which only applies to `batch`")
+    if args.mode == "batch":
+        # Every other option is set per job in the batch file, and would be silently ignored.
+        defaults = vars(parser.parse_args(["batch"]))
+        batch_options = {"batch_file", "jobs", "cache_dir", "no_cache", "snapshot"}
+        if any(v != defaults[k] for k, v in vars(args).items() if k not in batch_options):
+            parser.error("`batch` takes its options from --batch-file, and only --jobs, --cache-dir, --no-cache "
+                         "and --no-snapshot on the command line")
+    if args.offline and args.no_cache and args.path is None:
+        parser.error("--offline requires the cache")
+    if args.check and args.no_cache and args.path is None:
+        parser.error("--check requires the cache")
+    if args.check and args.test_ids == "update":
+        parser.error("--check can only be combined with --test-ids verify")
+    if args.mode in ("watch", "serve"):
+        if args.path is None:
+            parser.error(f"`{args.mode}` requires --from")
+        if args.check or args.compare_profiles or args.bench_snapshot or args.bench_jobs or args.test_ids == "update":
+            parser.error(f"`{args.mode}` can't be combined with --check, --compare-profiles, --bench-snapshot, "
+                         "--bench-jobs or --test-ids update")
+    if args.mode != "batch" and args.external_fmt and shutil.which("forge") is None:
+        print("warning: `forge` not found, formatting in-process", file=sys.stderr)
+        args.external_fmt = False
+    if args.mode == "generate":
+        run(args)
+    elif args.mode == "batch":
+        run_batch(args.batch_file, args.cache_dir if args.snapshot and not args.no_cache else None, args.jobs)
+    else:
+        socket_path = None
+        if args.mode == "serve":
+            socket_path = args.socket or os.path.join(args.cache_dir, "serve", output_key() + ".sock")
+        watch(args, socket_path)
+
+
+# Generates the outputs selected by the command line `args`. `warm` holds the state kept between
+# runs by `watch`: the last model, the caches and the process pool.
+def run(args, warm: "WarmState | None" = None):
+    import concurrent.futures
+
+    if warm is not None:
+        run_with_pool(args, warm, warm.executor)
+        return
+    executor = concurrent.futures.ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+    try:
+        run_with_pool(args, None, executor)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+# `run`, with the process pool of `--jobs`, which is shared by selector hashing and rendering.
+def run_with_pool(args, warm: "WarmState | None", executor: "concurrent.futures.Executor | None"):
+    from urllib import request
+
+    filter = CheatcodeFilter(
+        groups=args.groups,
+        exclude_groups=args.exclude_groups,
+        statuses=args.status,
+        exclude_statuses=args.exclude_status,
+        safety=args.safety,
+    )
+    write = True
+    if args.path is None and args.no_cache:
+        if args.prune_to:
+            used = scan_cheatcode_usage(args.prune_to, args.prune_receivers, args.cache_dir, args.jobs)
+        manifest = None
+        with request.urlopen(args.url, timeout=args.timeout) as res:
+            contract = Cheatcodes.from_json_stream(res, filter)
+        safe, unsafe = partition_cheatcodes(contract.cheatcodes, filter)
+        snapshot, verified = None, False
+    else:
+        if args.path is None:
+            args.path = SpecCache(args.cache_dir).fetch(args.url, offline=args.offline, timeout=args.timeout)
+        options = {
+            "filter": filter.to_dict(),
+            "external_fmt": args.external_fmt,
+            "split": args.split,
+            "profile": args.profile,
+            "abi_dir": args.abi_dir,
+            "selector_db": args.selector_db,
+        }
+        if args.prune_to:
+            used = scan_cheatcode_usage(args.prune_to, args.prune_receivers, args.cache_dir, args.jobs)
+            options["prune"] = sorted(used)
+        manifest = build_manifest(args.path, options)
+        if args.bench_snapshot:
+            print_snapshot_benchmark(args.path, filter)
+            return
+        if args.bench_jobs:
+            print_jobs_benchmark(args.path, filter, args.bench_jobs)
+            return
+        fresh = is_fresh(OUT_PATH, manifest)
+        if args.check:
+            print(f"{OUT_PATH} is {'up to date' if fresh else 'out of date'}")
+            if not fresh:
+                sys.exit(1)
+            write = False
+        elif fresh and not args.force:
+            print(f"{OUT_PATH} is up to date")
+            write = False
+        if not write and not args.compare_profiles and args.test_ids is None:
+            return
+        snapshot = model = None
+        if warm is not None:
+            model = warm.model(manifest["input"], filter)
+        if model is None and args.snapshot and not args.no_cache:
+            snapshot = ModelSnapshot(args.cache_dir, manifest["input"], manifest["generator"], filter)
+            model = snapshot.load()
+        if model is None:
+            contract = Cheatcodes.from_json_file(args.path, filter)
+            safe, unsafe = partition_cheatcodes(contract.cheatcodes, filter)
+            verified = False
+        else:
+            contract, safe, unsafe, verified = model
+            # Already saved, unless it's verified below.
+            snapshot = snapshot if args.verify_selectors and not verified else None
+
+    if args.verify_selectors and not verified:
+        problems = verify_selectors(safe, unsafe, executor, args.jobs)
+        for problem in problems:
+            print(f"error: {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+        verified = True
+    if snapshot is not None:
+        snapshot.save(contract, safe, unsafe, verified)
+    if warm is not None and manifest is not None:
+        warm.remember(manifest["input"], filter, (contract, safe, unsafe, verified))
+    if args.prune_to:
+        contract, safe, unsafe = prune_cheatcodes(contract, safe, unsafe, used)
+
+    ids = interface_ids(safe, unsafe, args.split)
+    if args.test_ids is not None and not sync_test_interface_ids(TEST_PATH, ids, args.test_ids == "update"):
+        sys.exit(1)
+    if not write and not args.compare_profiles:
+        return
+
+    abis = {}
+    if args.abi_dir is not None:
+        abis, problems = build_abis(contract, safe, unsafe, args.abi_dir)
+        for problem in problems:
+            print(f"error: {problem}", file=sys.stderr)
+        if problems:
+            sys.exit(1)
+
+    if warm is not None:
+        fragment_cache, fmt_cache = warm.fragment_cache, warm.fmt_cache
+    else:
+        fragment_cache = None
+        if args.render_cache:
+            fragment_cache = FragmentCache(os.path.join(args.cache_dir, "render", output_key() + ".json"))
+        fmt_cache = None
+        if args.external_fmt and args.fmt_cache:
+            fmt_cache = FmtCache(os.path.join(args.cache_dir, "fmt"), args.fmt_cache_size)
+    printer_options = vm_printer_options(
+        args.profile,
+        canonical=not args.external_fmt,
+        fragment_cache=fragment_cache,
+        executor=executor,
+        jobs=args.jobs,
+    )
+    if warm is not None:
+        warm.emitted = (contract, safe, unsafe, printer_options)
 
-    prefix_with_group_headers(safe)
-    prefix_with_group_headers(unsafe)
+    if args.compare_profiles:
+        print_profile_comparison(compare_profiles(contract, safe, unsafe, printer_options))
+        return
 
-    out = ""
+    if args.split:
+        renders = split_renders(contract, safe, unsafe, OUT_PATH, os.path.join(os.path.dirname(OUT_PATH), SPLIT_DIR))
+    else:
+        renders = {OUT_PATH: lambda pp: p_vm(pp, contract, safe, unsafe)}
 
-    out += "// Automatically @generated by scripts/vm.py. Do not modify manually.\n\n"
+    for path, render in renders.items():
+        if write_rendered(path, render, printer_options, args.external_fmt, fmt_cache):
+            print(f"Wrote to {path}")
+        else:
+            print(f"{path} is unchanged")
 
-    pp = CheatcodesPrinter(
+    if args.selector_db is not None:
+        if write_if_changed(args.selector_db, SelectorDatabase.build(safe + unsafe)):
+            print(f"Wrote to {args.selector_db}")
+        else:
+            print(f"{args.selector_db} is unchanged")
+    for path, abi in abis.items():
+        if write_if_changed(path, encode_abi(abi)):
+            print(f"Wrote to {path}")
+        else:
+            print(f"{path} is unchanged")
+    remove_stale_outputs(os.path.join(os.path.dirname(OUT_PATH), SPLIT_DIR), renders)
+    if fragment_cache is not None:
+        fragment_cache.save()
+    write_if_changed(interface_ids_path(OUT_PATH), encode_interface_ids(ids))
+    if manifest is not None:
+        extra_outputs = list(abis) + ([args.selector_db] if args.selector_db is not None else [])
+        write_manifest(manifest, extra_outputs + list(renders))
+
+
+# Options of the printer for the generated interfaces, with the comments of `profile`.
+def vm_printer_options(profile: str = "full", **options) -> dict:
+    return dict(
+        prelude=False,
         spdx_identifier="MIT OR Apache-2.0",
         solidity_requirement=">=0.8.13 <0.9.0",
+        # Compatibility with <0.8.0
+        memory_to_calldata=True,
+        **PROFILES[profile],
+        **options,
     )
+
+
+GENERATED_HEADER = "// Automatically @generated by scripts/vm.py. Do not modify manually.\n\n"
+
+# Directory, relative to the output, that holds the per-group interfaces written by `--split`.
+SPLIT_DIR = "vm"
+
+
+def p_vm(
+    pp: "CheatcodesPrinter",
+    contract: "Cheatcodes",
+    safe: list["Cheatcode"],
+    unsafe: list["Cheatcode"],
+):
+    pp.p_raw(GENERATED_HEADER)
     pp.p_prelude()
-    pp.prelude = False
-    out += pp.finish()
+    pp.finish()
 
-    out += "\n\n"
-    out += VM_SAFE_DOC
+    pp.p_raw("\n\n")
+    if pp.comments != "none":
+        pp.p_raw(VM_SAFE_DOC)
     vm_safe = Cheatcodes(
         # TODO: Custom errors were introduced in 0.8.4
         errors=[],  # contract.errors
@@ -76,78 +474,1299 @@ def main():
         cheatcodes=safe,
     )
     pp.p_contract(vm_safe, "VmSafe")
-    out += pp.finish()
-
-    out += "\n\n"
-    out += VM_DOC
-    vm_unsafe = Cheatcodes(
-        errors=[],
-        events=[],
-        enums=[],
-        structs=[],
-        cheatcodes=unsafe,
+    pp.finish()
+
+    pp.p_raw("\n\n")
+    if pp.comments != "none":
+        pp.p_raw(VM_DOC)
+    pp.p_contract(Cheatcodes(errors=[], events=[], enums=[], structs=[], cheatcodes=unsafe), "Vm", "VmSafe")
+
+
+# Renders `Vm.sol` in memory, formatted in-process.
+def render_vm(
+    contract: "Cheatcodes",
+    safe: list["Cheatcode"],
+    unsafe: list["Cheatcode"],
+    printer_options: dict,
+) -> str:
+    return render_text(lambda pp: p_vm(pp, contract, safe, unsafe), printer_options)
+
+
+def render_text(render: Callable[["CheatcodesPrinter"], None], printer_options: dict) -> str:
+    sink = io.StringIO()
+    pp = CheatcodesPrinter(sink=sink, **dict(printer_options, canonical=True))
+    render(pp)
+    pp.finish("\n")
+    return sink.getvalue()
+
+
+# Renders the interface with every profile in `PROFILES` and measures it. If `solc` is installed,
+# also measures how long `solc --stop-after parsing` takes to parse each variant, best of `runs`.
+def compare_profiles(
+    contract: "Cheatcodes",
+    safe: list["Cheatcode"],
+    unsafe: list["Cheatcode"],
+    printer_options: dict,
+    runs: int = 3,
+) -> list[dict]:
+    solc = shutil.which("solc")
+    results = []
+    for profile, profile_options in PROFILES.items():
+        out = render_vm(contract, safe, unsafe, dict(printer_options, fragment_cache=None, **profile_options))
+        result = {"profile": profile, "bytes": len(out.encode()), "lines": out.count("\n"), "parse_s": None}
+        if solc is not None:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, "Vm.sol")
+                with open(path, "w") as f:
+                    f.write(out)
+                best = None
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    res = subprocess.run([solc, "--stop-after", "parsing", path], capture_output=True)
+                    elapsed = time.perf_counter() - start
+                    assert res.returncode == 0, f"solc failed on the {profile} profile: {res.stderr.decode()}"
+                    best = elapsed if best is None else min(best, elapsed)
+                result["parse_s"] = best
+        results.append(result)
+    return results
+
+
+def print_profile_comparison(results: list[dict]):
+    full = results[0]
+    print(f"{'profile':<10} {'bytes':>10} {'lines':>8} {'parse (ms)':>12}")
+    for r in results:
+        parse = "n/a" if r["parse_s"] is None else f"{r['parse_s'] * 1000:.1f}"
+        ratio = r["bytes"] / full["bytes"] * 100
+        print(f"{r['profile']:<10} {r['bytes']:>10} {r['lines']:>8} {parse:>12}   ({ratio:.0f}% of {full['profile']})")
+
+
+# Times parsing the cheatcodes json at `path`, and loading a snapshot of the same model, best of
+# `runs` each.
+def print_snapshot_benchmark(path: str, filter: "CheatcodeFilter", runs: int = 10):
+    def best(f: Callable[[], object]) -> float:
+        times = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            f()
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    def parse():
+        contract = Cheatcodes.from_json_file(path, filter)
+        return contract, *partition_cheatcodes(contract.cheatcodes, filter)
+
+    contract, safe, unsafe = parse()
+    data = ModelSnapshot.encode(contract, safe, unsafe, verified=False)
+    parse_s = best(parse)
+    load_s = best(lambda: ModelSnapshot.decode(data))
+    print(f"json:     {os.path.getsize(path):>10} bytes {parse_s * 1000:>8.1f} ms")
+    print(f"snapshot: {len(data):>10} bytes {load_s * 1000:>8.1f} ms ({parse_s / load_s:.1f}x faster)")
+
+
+# Times rendering the functions of a synthetic spec of at least `functions` functions, made of copies
+# of the cheatcodes json at `path`, with each number of workers in `jobs`, best of `runs` each. The
+# fragment cache is disabled, every output is checked against the serial one, and speedups are
+# relative to the first number of workers.
+def print_jobs_benchmark(path: str, filter: "CheatcodeFilter", jobs: list[int], functions: int = 50_000, runs: int = 3):
+    import concurrent.futures
+
+    contract = Cheatcodes.from_json_file(path, filter)
+    safe, unsafe = partition_cheatcodes(contract.cheatcodes, filter)
+    copies = max(1, -(-functions // max(1, len(safe) + len(unsafe))))
+    # Copies stay next to their original, so that groups stay contiguous.
+    cheatcodes = [cc for cc in safe + unsafe for _ in range(copies)]
+    options = vm_printer_options(canonical=True, fragment_cache=None)
+    serial = render_text(lambda pp: pp.p_functions(cheatcodes), options)
+
+    print(f"{len(cheatcodes)} functions, {os.cpu_count()} cores")
+    print(f"{'jobs':<6} {'time (ms)':>10} {'speedup':>8}")
+    base_s = None
+    for n in jobs:
+        executor = concurrent.futures.ProcessPoolExecutor(n) if n > 1 else None
+        try:
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                out = render_text(lambda pp: pp.p_functions(cheatcodes), dict(options, executor=executor, jobs=n))
+                times.append(time.perf_counter() - start)
+                assert out == serial, f"output with {n} jobs differs from the serial output"
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        best_s = min(times)
+        base_s = base_s or best_s
+        print(f"{n:<6} {best_s * 1000:>10.1f} {base_s / best_s:>7.2f}x")
+
+
+# Options of `generate`. Paths only name the artifacts and the imports between them: nothing is
+# written.
+class GenerateOptions:
+    __slots__ = ("filter", "profile", "split", "out_path", "prune", "abi_dir", "selector_db", "verify_selectors")
+
+    filter: "CheatcodeFilter"
+    profile: str
+    split: bool
+    out_path: str
+    # Names of the cheatcodes to keep, as with `--prune-to`, or `None` to keep them all.
+    prune: set[str] | None
+    abi_dir: str | None
+    selector_db: str | None
+    verify_selectors: bool
+
+    def __init__(
+        self,
+        filter: "CheatcodeFilter | None" = None,
+        profile: str = "full",
+        split: bool = False,
+        out_path: str = OUT_PATH,
+        prune: set[str] | None = None,
+        abi_dir: str | None = None,
+        selector_db: str | None = None,
+        verify_selectors: bool = True,
+    ):
+        if profile not in PROFILES:
+            raise ValueError(f"unknown profile {profile!r}")
+        self.filter = filter or DEFAULT_FILTER
+        self.profile = profile
+        self.split = split
+        self.out_path = out_path
+        self.prune = prune
+        self.abi_dir = abi_dir
+        self.selector_db = selector_db
+        self.verify_selectors = verify_selectors
+
+    # Options as written in a `batch` file: the keyword arguments of the constructor, with the
+    # filter as in `CheatcodeFilter.to_dict`, `prune` as a list and the path of the output as
+    # `output`.
+    @staticmethod
+    def from_dict(d: dict) -> "GenerateOptions":
+        d = dict(d)
+        if "filter" in d:
+            d["filter"] = CheatcodeFilter.from_dict(d["filter"])
+        if "output" in d:
+            d["out_path"] = d.pop("output")
+        if d.get("prune") is not None:
+            d["prune"] = set(d["prune"])
+        unknown = set(d) - set(GenerateOptions.__slots__)
+        if unknown:
+            raise ValueError(f"unknown options: {', '.join(sorted(unknown))}")
+        return GenerateOptions(**d)
+
+
+# Generates interfaces for many specs and options in one process. Parsed models are kept by input and
+# filter, and rendered fragments are shared by all the jobs, so that jobs on the same spec, or on
+# specs that differ in a few cheatcodes, only render what's new.
+class Generator:
+    cache_dir: str | None
+    jobs: int
+    fragment_cache: "FragmentCache"
+    executor: "concurrent.futures.Executor | None"
+    _models: "dict[tuple[str, str], tuple[Cheatcodes, list[Cheatcode], list[Cheatcode]]]"
+    _verified: set[tuple[str, str]]
+
+    # With `cache_dir`, models are also loaded from, and saved to, snapshots in it.
+    def __init__(self, cache_dir: str | None = None, jobs: int = 1):
+        import concurrent.futures
+
+        self.cache_dir = cache_dir
+        self.jobs = jobs
+        self.fragment_cache = FragmentCache(None)
+        self.executor = concurrent.futures.ProcessPoolExecutor(jobs) if jobs > 1 else None
+        self._models = {}
+        self._verified = set()
+
+    def __enter__(self) -> "Generator":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    # Returns the generated files by path: the interfaces, their interface IDs and, if requested,
+    # the ABIs and the selector database. `spec` is the path of a cheatcodes json, or its model.
+    # Raises `ValueError` with every problem found if the selectors, or the ABIs, don't match the spec.
+    def generate(self, spec: "str | Cheatcodes", options: GenerateOptions | None = None) -> dict[str, bytes]:
+        if options is None:
+            options = GenerateOptions()
+        filter = options.filter
+        if isinstance(spec, Cheatcodes):
+            key = None
+            contract = spec
+            safe, unsafe = partition_cheatcodes(spec.cheatcodes, filter)
+        else:
+            key = (file_sha256(spec), json.dumps(filter.to_dict(), sort_keys=True))
+            model = self._models.get(key)
+            if model is None:
+                model = self._models[key] = load_model(spec, filter, self.cache_dir)
+            contract, safe, unsafe = model
+
+        if options.verify_selectors and key not in self._verified:
+            problems = verify_selectors(safe, unsafe, self.executor, self.jobs)
+            if problems:
+                raise ValueError("\n".join(problems))
+            if key is not None:
+                self._verified.add(key)
+        if options.prune is not None:
+            contract, safe, unsafe = prune_cheatcodes(contract, safe, unsafe, options.prune)
+
+        out_path = options.out_path
+        if options.split:
+            split_dir = os.path.join(os.path.dirname(out_path), SPLIT_DIR)
+            renders = split_renders(contract, safe, unsafe, out_path, split_dir)
+        else:
+            renders = {out_path: lambda pp: p_vm(pp, contract, safe, unsafe)}
+        printer_options = vm_printer_options(
+            options.profile,
+            canonical=True,
+            fragment_cache=self.fragment_cache,
+            executor=self.executor,
+            jobs=self.jobs,
+        )
+        artifacts = {path: render_text(render, printer_options).encode() for path, render in renders.items()}
+        artifacts[interface_ids_path(out_path)] = encode_interface_ids(interface_ids(safe, unsafe, options.split))
+        if options.abi_dir is not None:
+            abis, problems = build_abis(contract, safe, unsafe, options.abi_dir)
+            if problems:
+                raise ValueError("\n".join(problems))
+            artifacts.update((path, encode_abi(abi)) for path, abi in abis.items())
+        if options.selector_db is not None:
+            artifacts[options.selector_db] = SelectorDatabase.build(safe + unsafe)
+        return artifacts
+
+
+# Generates the files for a single spec, as `Generator.generate`. Use a `Generator` to generate
+# several.
+def generate(spec: "str | Cheatcodes", options: GenerateOptions | None = None) -> dict[str, bytes]:
+    with Generator() as generator:
+        return generator.generate(spec, options)
+
+
+# Runs the jobs of a `batch` file: a json list of objects with the `input` json and the options of
+# `GenerateOptions.from_dict`, and writes the files that changed.
+def run_batch(path: str, cache_dir: str | None, jobs: int = 1):
+    with open(path) as f:
+        batch = json.load(f)
+    assert isinstance(batch, list), f"{path} must contain a list of jobs"
+    with Generator(cache_dir, jobs) as generator:
+        for job in batch:
+            job = dict(job)
+            spec = job.pop("input")
+            try:
+                options = GenerateOptions.from_dict(job)
+                artifacts = generator.generate(spec, options)
+            except ValueError as e:
+                for problem in str(e).splitlines():
+                    print(f"error: {spec}: {problem}", file=sys.stderr)
+                sys.exit(1)
+            for out, data in artifacts.items():
+                if write_if_changed(out, data):
+                    print(f"Wrote to {out}")
+                else:
+                    print(f"{out} is unchanged")
+            remove_stale_outputs(os.path.join(os.path.dirname(options.out_path), SPLIT_DIR), artifacts)
+
+
+# State kept between the runs of `watch` and `serve`: the last model, the caches, the process pool,
+# and what the last run emitted, so that a regeneration only re-parses the input and re-renders the
+# items that changed.
+class WarmState:
+    fragment_cache: "FragmentCache | None"
+    fmt_cache: "FmtCache | None"
+    executor: "concurrent.futures.Executor | None"
+    # `(contract, safe, unsafe, printer_options)` of the last run, after pruning.
+    emitted: "tuple[Cheatcodes, list[Cheatcode], list[Cheatcode], dict] | None"
+    _model_key: tuple[str, str] | None
+    _model: "tuple[Cheatcodes, list[Cheatcode], list[Cheatcode], bool] | None"
+    _by_selector: "dict[int, Cheatcode] | None"
+
+    def __init__(self, args):
+        import concurrent.futures
+
+        self.fragment_cache = None
+        if args.render_cache:
+            self.fragment_cache = FragmentCache(os.path.join(args.cache_dir, "render", output_key() + ".json"))
+        self.fmt_cache = None
+        if args.external_fmt and args.fmt_cache:
+            self.fmt_cache = FmtCache(os.path.join(args.cache_dir, "fmt"), args.fmt_cache_size)
+        self.executor = concurrent.futures.ProcessPoolExecutor(args.jobs) if args.jobs > 1 else None
+        self.emitted = None
+        self._model_key = None
+        self._model = None
+        self._by_selector = None
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    # The model remembered for `input_digest` and `filter`, if it's the last one.
+    def model(
+        self,
+        input_digest: str,
+        filter: "CheatcodeFilter",
+    ) -> "tuple[Cheatcodes, list[Cheatcode], list[Cheatcode], bool] | None":
+        if self._model_key == (input_digest, json.dumps(filter.to_dict(), sort_keys=True)):
+            return self._model
+        return None
+
+    def remember(
+        self,
+        input_digest: str,
+        filter: "CheatcodeFilter",
+        model: "tuple[Cheatcodes, list[Cheatcode], list[Cheatcode], bool]",
+    ):
+        key = (input_digest, json.dumps(filter.to_dict(), sort_keys=True))
+        if key != self._model_key:
+            self._model_key = key
+            self._model = model
+            self._by_selector = None
+
+    def by_selector(self) -> "dict[int, Cheatcode]":
+        assert self._model is not None, "no model loaded yet"
+        if self._by_selector is None:
+            _, safe, unsafe, _ = self._model
+            self._by_selector = {cc.func.selector_int: cc for cc in safe + unsafe}
+        return self._by_selector
+
+    # Runs `run(args, self)`, and returns whether it succeeded and what it printed. Failures, such as
+    # an input saved half-way through an edit, are reported instead of stopping the caller.
+    def generate(self, args) -> tuple[bool, str]:
+        import contextlib
+        import traceback
+
+        out = io.StringIO()
+        ok = True
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+            try:
+                run(args, self)
+            except SystemExit as e:
+                ok = not e.code
+            except Exception:
+                traceback.print_exc()
+                ok = False
+        return ok, out.getvalue()
+
+
+# Detects changes to a file, through inotify on Linux and by polling its `stat` elsewhere. inotify
+# watches the file's directory, so that editors that save by replacing the file are noticed too.
+class FileWatcher:
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+
+    path: str
+    # How long to wait between checks, or `None` if `fileno()` becomes readable on changes.
+    timeout: float | None
+    _fd: int | None
+    _stat: tuple[int, int, int] | None
+
+    def __init__(self, path: str, poll_interval: float):
+        self.path = os.path.abspath(path)
+        self._stat = self._stat_key()
+        self._fd = self._inotify(os.path.dirname(self.path))
+        self.timeout = None if self._fd is not None else poll_interval
+
+    @staticmethod
+    def _inotify(dir: str) -> int | None:
+        if not sys.platform.startswith("linux"):
+            return None
+        import ctypes
+
+        try:
+            libc = ctypes.CDLL(None, use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        mask = FileWatcher.IN_CLOSE_WRITE | FileWatcher.IN_MOVED_TO | FileWatcher.IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(dir), mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _stat_key(self) -> tuple[int, int, int] | None:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def fileno(self) -> int | None:
+        return self._fd
+
+    # Whether the file changed since the last call. Never blocks.
+    def changed(self) -> bool:
+        if self._fd is not None:
+            try:
+                while os.read(self._fd, 1 << 16):
+                    pass
+            except BlockingIOError:
+                pass
+        key = self._stat_key()
+        if key == self._stat:
+            return False
+        self._stat = key
+        return key is not None
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+# Keeps the model, caches and process pool warm, and regenerates the outputs whenever the `--from`
+# file changes. With `socket_path`, also answers requests from other tools on that Unix socket; see
+# `handle_request`. Open connections are watched along with the file, so a client that keeps its
+# connection open doesn't hold up regenerations: every wakeup regenerates first if the file changed,
+# and then answers the requests that arrived.
+def watch(args, socket_path: str | None = None):
+    import select
+    import signal
+
+    # Shut down cleanly, removing the socket, when terminated too.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    # Every change of the input is regenerated, and unchanged outputs are still left untouched.
+    args.force = True
+    warm = WarmState(args)
+    watcher = FileWatcher(args.path, args.poll_interval)
+    server = None
+    if socket_path is not None:
+        server = listen_unix(socket_path)
+        print(f"Listening on {socket_path}")
+    # Open connections, with the start of any request not fully received yet.
+    clients: dict["socket.socket", bytearray] = {}
+
+    def regenerate():
+        start = time.perf_counter()
+        ok, output = warm.generate(args)
+        sys.stdout.write(output)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"{'Regenerated' if ok else 'Failed to regenerate'} in {elapsed:.1f} ms", flush=True)
+
+    try:
+        regenerate()
+        how = "inotify" if watcher.timeout is None else f"polling every {watcher.timeout}s"
+        print(f"Watching {args.path} ({how})", flush=True)
+        while True:
+            fds = [f for f in (watcher.fileno(), server) if f is not None] + list(clients)
+            readable, _, _ = select.select(fds, [], [], watcher.timeout)
+            if watcher.changed():
+                regenerate()
+            for conn in readable:
+                if conn is server:
+                    conn, _ = server.accept()
+                    # Don't let a client that stops reading its responses block the daemon.
+                    conn.settimeout(10)
+                    clients[conn] = bytearray()
+                elif conn in clients and not serve_requests(conn, clients[conn], args, warm):
+                    del clients[conn]
+                    conn.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for conn in clients:
+            conn.close()
+        watcher.close()
+        warm.close()
+        if server is not None:
+            server.close()
+            os.unlink(socket_path)
+
+
+# Binds a Unix socket at `path`. A socket left behind by a daemon that is no longer running is
+# replaced, but a live one is not.
+def listen_unix(path: str) -> "socket.socket":
+    import socket
+
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    else:
+        assert stat.S_ISSOCK(st.st_mode), f"{path} exists and is not a socket"
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.unlink(path)
+            else:
+                raise AssertionError(f"another server is already listening on {path}")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    return server
+
+
+# Reads what is available on `conn`, which must be readable, and answers every complete request.
+# Requests and responses are JSON objects, one per line, and `buf` holds the start of a request until
+# the rest of it arrives. Returns whether the connection is still open.
+def serve_requests(conn: "socket.socket", buf: bytearray, args, warm: "WarmState") -> bool:
+    try:
+        data = conn.recv(1 << 16)
+    except OSError:
+        return False
+    if not data:
+        return False
+    buf += data
+    while (end := buf.find(b"\n")) != -1:
+        line = bytes(buf[:end])
+        del buf[:end + 1]
+        try:
+            response = handle_request(json.loads(line), args, warm)
+        except Exception as e:
+            response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        try:
+            conn.sendall((json.dumps(response) + "\n").encode())
+        except OSError:
+            return False
+    return True
+
+
+# Requests, by `op`:
+# - `generate`: regenerates the outputs now. Returns `output`, what the run printed.
+# - `render`: returns `source`, the `Vm.sol` of the last run rendered in memory with `profile`
+#   (default: the one of the command line), without writing it.
+# - `lookup`: returns the cheatcode with `selector`, given as hex, in `cheatcode`, or `null`.
+# - `interface_ids`: returns the interface IDs of the last run in `ids`.
+def handle_request(req: dict, args, warm: "WarmState") -> dict:
+    op = req.get("op")
+    if op == "generate":
+        ok, output = warm.generate(args)
+        return {"ok": ok, "output": output}
+    assert warm.emitted is not None, "nothing generated yet"
+    contract, safe, unsafe, printer_options = warm.emitted
+    if op == "render":
+        profile = req.get("profile", args.profile)
+        assert profile in PROFILES, f"unknown profile {profile!r}"
+        options = dict(printer_options, **PROFILES[profile])
+        return {"ok": True, "source": render_vm(contract, safe, unsafe, options)}
+    if op == "lookup":
+        cc = warm.by_selector().get(int(req["selector"], 16))
+        if cc is None:
+            return {"ok": True, "cheatcode": None}
+        return {
+            "ok": True,
+            "cheatcode": {
+                "id": cc.func.id,
+                "signature": cc.func.signature,
+                "declaration": cc.func.declaration,
+                "group": cc.group,
+                "status": cc.status,
+                "safety": cc.safety,
+            },
+        }
+    if op == "interface_ids":
+        return {"ok": True, "ids": format_interface_ids(interface_ids(safe, unsafe, args.split))}
+    raise AssertionError(f"unknown op {op!r}")
+
+
+# Renders for `--split`: shared types go into `VmTypes`, and each group gets a file with a
+# `VmSafe<Group>` and/or `Vm<Group>` interface. `out_path` becomes an aggregator in which `VmSafe`
+# and `Vm` inherit from all of them. The aggregator still declares every function itself, because
+# `type(I).interfaceId` only covers the functions declared in `I`, not inherited ones.
+def split_renders(
+    contract: "Cheatcodes",
+    safe: list["Cheatcode"],
+    unsafe: list["Cheatcode"],
+    out_path: str,
+    split_dir: str,
+) -> dict[str, Callable[["CheatcodesPrinter"], None]]:
+    import_dir = "./" + os.path.relpath(split_dir, os.path.dirname(out_path) or ".").replace(os.sep, "/")
+    groups: dict[str, tuple[list[Cheatcode], list[Cheatcode]]] = {}
+    for cc in safe:
+        groups.setdefault(cc.group, ([], []))[0].append(cc)
+    for cc in unsafe:
+        groups.setdefault(cc.group, ([], []))[1].append(cc)
+
+    def p_header(pp: CheatcodesPrinter, imports: list[tuple[str, str]]):
+        pp.p_raw(GENERATED_HEADER)
+        pp.p_prelude()
+        for name, path in imports:
+            pp.p_raw(f'import {{{name}}} from "{path}";\n')
+        pp.finish()
+
+    def p_types(pp: CheatcodesPrinter):
+        p_header(pp, [])
+        pp.p_raw("\n\n")
+        if pp.comments != "none":
+            pp.p_raw("/// Types and events shared by all `Vm` interfaces.\n")
+        pp.p_contract(Cheatcodes([], contract.events, contract.enums, contract.structs, []), "VmTypes")
+
+    def p_group(pp: CheatcodesPrinter, g: str, group_safe: list[Cheatcode], group_unsafe: list[Cheatcode]):
+        pp.group_headers = False
+        p_header(pp, [("VmTypes", "./VmTypes.sol")])
+        if group_safe:
+            pp.p_raw("\n\n")
+            if pp.comments != "none":
+                pp.p_raw(f"/// `{g}` cheatcodes of `VmSafe`.\n")
+            pp.p_contract(Cheatcodes([], [], [], [], group_safe), f"VmSafe{group_title(g)}", "VmTypes")
+            pp.finish()
+        if group_unsafe:
+            pp.p_raw("\n\n")
+            if pp.comments != "none":
+                pp.p_raw(f"/// `{g}` cheatcodes of `Vm`.\n")
+            pp.p_contract(Cheatcodes([], [], [], [], group_unsafe), f"Vm{group_title(g)}", "VmTypes")
+
+    def p_aggregator(pp: CheatcodesPrinter):
+        safe_bases = [f"VmSafe{group_title(g)}" for g, (s, _) in groups.items() if s]
+        unsafe_bases = [f"Vm{group_title(g)}" for g, (_, u) in groups.items() if u]
+        imports = [("VmTypes", f"{import_dir}/VmTypes.sol")]
+        for g, (group_safe, group_unsafe) in groups.items():
+            names = []
+            if group_safe:
+                names.append(f"VmSafe{group_title(g)}")
+            if group_unsafe:
+                names.append(f"Vm{group_title(g)}")
+            imports.append((", ".join(names), f"{import_dir}/{group_title(g)}.sol"))
+        p_header(pp, imports)
+
+        pp.p_raw("\n\n")
+        if pp.comments != "none":
+            pp.p_raw(VM_SAFE_DOC)
+        pp.p_contract(Cheatcodes([], [], [], [], safe), "VmSafe", ", ".join(["VmTypes"] + safe_bases))
+        pp.finish()
+
+        pp.p_raw("\n\n")
+        if pp.comments != "none":
+            pp.p_raw(VM_DOC)
+        pp.p_contract(Cheatcodes([], [], [], [], unsafe), "Vm", ", ".join(["VmSafe"] + unsafe_bases))
+
+    renders = {os.path.join(split_dir, "VmTypes.sol"): p_types}
+    for g, (group_safe, group_unsafe) in groups.items():
+        renders[os.path.join(split_dir, f"{group_title(g)}.sol")] = (
+            lambda pp, g=g, s=group_safe, u=group_unsafe: p_group(pp, g, s, u)
+        )
+    renders[out_path] = p_aggregator
+    return renders
+
+
+# Recomputes the selector of every cheatcode from its signature, and looks for selectors shared by
+# two cheatcodes, in the same interface or across `VmSafe` and `Vm`. Also reports selectors whose hex
+# and byte forms disagree in the spec. Returns a description of every problem found. Hashing is done
+# in batches, split across the `jobs` workers of `executor` if given.
+def verify_selectors(
+    safe: list["Cheatcode"],
+    unsafe: list["Cheatcode"],
+    executor: "concurrent.futures.Executor | None" = None,
+    jobs: int = 1,
+) -> list[str]:
+    cheats = safe + unsafe
+    signatures = [cc.func.signature.encode() for cc in cheats]
+    if executor is not None and jobs > 1 and len(signatures) > KECCAK_BATCH:
+        shard_size = max(KECCAK_BATCH, -(-len(signatures) // jobs))
+        shards = [signatures[i:i + shard_size] for i in range(0, len(signatures), shard_size)]
+        digests = [d for shard in executor.map(keccak256_batch, shards) for d in shard]
+    else:
+        digests = keccak256_batch(signatures)
+
+    problems = []
+    # Selector -> index of the first cheatcode that uses it.
+    seen: dict[int, int] = {}
+    for i, (cc, digest) in enumerate(zip(cheats, digests)):
+        func = cc.func
+        if func.selector_error is not None:
+            problems.append(f"`{func.id}`: {func.selector_error}")
+        expected = int.from_bytes(digest[:4], "big")
+        if func.selector_int != expected:
+            problems.append(
+                f"`{func.id}` has selector {func.selector}, but keccak256(\"{func.signature}\") starts "
+                f"with 0x{expected:08x}"
+            )
+        j = seen.setdefault(func.selector_int, i)
+        if j != i:
+            problems.append(
+                f"`{cheats[j].func.id}` ({'VmSafe' if j < len(safe) else 'Vm'}) and `{func.id}` "
+                f"({'VmSafe' if i < len(safe) else 'Vm'}) share selector {func.selector}"
+            )
+    return problems
+
+
+# The ERC-165 interface ID of an interface: the XOR of the selectors of the functions it declares
+# itself. Inherited functions don't count, so `Vm`'s ID only covers the unsafe cheatcodes.
+def interface_id(cheats: list["Cheatcode"]) -> int:
+    return functools.reduce(operator.xor, (cc.func.selector_int for cc in cheats), 0)
+
+
+# The IDs of every interface the generated outputs declare functions in, by interface name.
+def interface_ids(safe: list["Cheatcode"], unsafe: list["Cheatcode"], split: bool = False) -> dict[str, int]:
+    ids = {"VmSafe": interface_id(safe), "Vm": interface_id(unsafe)}
+    if split:
+        for prefix, cheats in (("VmSafe", safe), ("Vm", unsafe)):
+            for cc in cheats:
+                name = prefix + group_title(cc.group)
+                ids[name] = ids.get(name, 0) ^ cc.func.selector_int
+    return ids
+
+
+def format_interface_ids(ids: dict[str, int]) -> dict[str, str]:
+    return {name: f"0x{id:08x}" for name, id in ids.items()}
+
+
+def interface_ids_path(out_path: str) -> str:
+    head, tail = os.path.split(out_path)
+    return os.path.join(head, f".{tail}.interface-ids.json")
+
+
+TEST_INTERFACE_ID_RE = re.compile(r"type\((\w+)\)\.interfaceId,\s*bytes4\((0x[0-9a-fA-F]{8})\)")
+
+
+# Compares the interface IDs asserted in `test_path` with `ids`, and reports every mismatch. With
+# `update`, rewrites the mismatched constants instead. Returns whether the test file ends up
+# matching `ids`.
+def sync_test_interface_ids(test_path: str, ids: dict[str, int], update: bool = False) -> bool:
+    with open(test_path) as f:
+        src = f.read()
+    mismatches = []
+
+    def sub(m: re.Match) -> str:
+        name, old = m.group(1), int(m.group(2), 16)
+        new = ids.get(name)
+        if new is None or new == old:
+            return m.group(0)
+        mismatches.append((name, old, new))
+        return f"type({name}).interfaceId, bytes4(0x{new:08x})"
+
+    updated = TEST_INTERFACE_ID_RE.sub(sub, src)
+    for name, old, new in mismatches:
+        action = "Updated" if update else "error:"
+        print(f"{action} `{name}` interface ID in {test_path}: 0x{old:08x} -> 0x{new:08x}", file=sys.stderr)
+    if not mismatches:
+        print(f"{test_path} interface IDs are up to date")
+        return True
+    if update:
+        write_if_changed(test_path, updated.encode())
+        return True
+    return False
+
+
+# Solidity's elementary types, as they can appear in a declaration.
+ELEMENTARY_TYPE_RE = re.compile(r"address(?: payable)?|bool|string|bytes(?:[1-9]|[12][0-9]|3[0-2])?|u?int[0-9]*")
+
+
+# Builds ABI JSON entries, as emitted by solc, from the declarations in the spec. Struct and enum
+# parameters are resolved against the spec's types, which are all declared in `VmSafe`. Any other
+# type that isn't elementary is rejected with a `ValueError`.
+class AbiBuilder:
+    structs: dict[str, "Struct"]
+    enums: frozenset[str]
+
+    def __init__(self, contract: "Cheatcodes"):
+        self.structs = {s.name: s for s in contract.structs}
+        self.enums = frozenset(e.name for e in contract.enums)
+
+    def functions(self, cheats: list["Cheatcode"]) -> list[dict]:
+        return [self.function(cc.func) for cc in cheats]
+
+    def function(self, func: "Function") -> dict:
+        head, params, attrs = split_declaration(func.declaration)
+        outputs = []
+        if attrs and attrs[-1].startswith("returns"):
+            _, returns, _ = split_declaration(attrs[-1] + ";")
+            outputs = [self.param(p) for p in returns]
+        return {
+            "type": "function",
+            "name": head.removeprefix("function ").strip(),
+            "inputs": [self.param(p) for p in params],
+            "outputs": outputs,
+            "stateMutability": str(func.mutability) or "nonpayable",
+        }
+
+    def events(self, events: list["Event"]) -> list[dict]:
+        entries = []
+        for event in events:
+            head, params, attrs = split_declaration(event.declaration)
+            entries.append({
+                "type": "event",
+                "name": head.removeprefix("event ").strip(),
+                "inputs": [self.param(p, event=True) for p in params],
+                "anonymous": "anonymous" in attrs,
+            })
+        return entries
+
+    # Parses a parameter such as `string[] calldata keys` or `address indexed target`.
+    def param(self, param: str, event: bool = False) -> dict:
+        words = param.split()
+        ty = words.pop(0)
+        if words and words[0] == "payable":
+            ty += " " + words.pop(0)
+        indexed = "indexed" in words
+        words = [w for w in words if w not in ("memory", "calldata", "storage", "indexed")]
+        assert len(words) <= 1, f"unexpected parameter: {param}"
+        entry = self.type_entry(ty)
+        entry["name"] = words[0] if words else ""
+        if event:
+            entry["indexed"] = indexed
+        return entry
+
+    # The `type`, `internalType` and, for structs, `components` of a type such as `Log[]`.
+    def type_entry(self, ty: str) -> dict:
+        i = ty.find("[")
+        base, dims = (ty, "") if i == -1 else (ty[:i], ty[i:])
+        struct = self.structs.get(base)
+        if struct is not None:
+            components = []
+            for field in struct.fields:
+                component = self.type_entry(field.ty)
+                component["name"] = field.name
+                components.append(component)
+            return {"type": "tuple" + dims, "internalType": f"struct VmSafe.{base}{dims}", "components": components}
+        if base in self.enums:
+            return {"type": "uint8" + dims, "internalType": f"enum VmSafe.{base}{dims}"}
+        if ELEMENTARY_TYPE_RE.fullmatch(base) is None:
+            raise ValueError(f"unknown type `{base}`: not an elementary type, or a struct or enum of the spec")
+        return {"type": base.removesuffix(" payable") + dims, "internalType": ty}
+
+
+# The canonical type of an ABI parameter, as used in signatures: tuples are spelled out.
+def abi_canonical_type(entry: dict) -> str:
+    ty = entry["type"]
+    if ty.startswith("tuple"):
+        return "(" + ",".join(map(abi_canonical_type, entry["components"])) + ")" + ty[len("tuple"):]
+    return ty
+
+
+def abi_signature(entry: dict) -> str:
+    return f"{entry['name']}({','.join(map(abi_canonical_type, entry['inputs']))})"
+
+
+# Checks that the ABI entry built for every cheatcode has the signature and selector of the spec.
+def check_abi_selectors(entries: list[dict], cheats: list["Cheatcode"]) -> list[str]:
+    signatures = [abi_signature(entry) for entry in entries]
+    digests = keccak256_batch([sig.encode() for sig in signatures])
+    problems = []
+    for cc, sig, digest in zip(cheats, signatures, digests):
+        func = cc.func
+        selector = int.from_bytes(digest[:4], "big")
+        if sig != func.signature or selector != func.selector_int:
+            problems.append(
+                f"`{func.id}`: the ABI built from its declaration has signature `{sig}` and selector "
+                f"0x{selector:08x}, but the spec has `{func.signature}` and {func.selector}"
+            )
+    return problems
+
+
+# The ABIs of `VmSafe` and `Vm`, by their path in `abi_dir`, and the problems found by
+# `check_abi_selectors`.
+def build_abis(
+    contract: "Cheatcodes",
+    safe: list["Cheatcode"],
+    unsafe: list["Cheatcode"],
+    abi_dir: str,
+) -> tuple[dict[str, list[dict]], list[str]]:
+    builder = AbiBuilder(contract)
+    safe_abi, unsafe_abi = builder.functions(safe), builder.functions(unsafe)
+    problems = check_abi_selectors(safe_abi + unsafe_abi, safe + unsafe)
+    events = builder.events(contract.events)
+    abis = {
+        os.path.join(abi_dir, "VmSafe.abi.json"): sort_abi(safe_abi + events),
+        os.path.join(abi_dir, "Vm.abi.json"): sort_abi(safe_abi + unsafe_abi + events),
+    }
+    return abis, problems
+
+
+def encode_abi(abi: list[dict]) -> bytes:
+    return (json.dumps(abi, indent=2, sort_keys=True) + "\n").encode()
+
+
+def encode_interface_ids(ids: dict[str, int]) -> bytes:
+    return (json.dumps(format_interface_ids(ids), indent=2) + "\n").encode()
+
+
+# Orders ABI entries like solc does: by type, then by name.
+def sort_abi(entries: list[dict]) -> list[dict]:
+    return sorted(entries, key=lambda entry: (entry["type"], entry.get("name", "")))
+
+
+# Removes files that a previous `--split` run generated in `split_dir` but that this run didn't, so
+# that a run without `--split` removes all of them. `split_dir` is removed too if that leaves it empty.
+def remove_stale_outputs(split_dir: str, outputs: dict[str, object]):
+    keep = {os.path.abspath(path) for path in outputs}
+    header = GENERATED_HEADER.encode()
+    removed = False
+    try:
+        it = os.scandir(split_dir)
+    except FileNotFoundError:
+        return
+    with it:
+        for e in it:
+            if not e.name.endswith(".sol") or os.path.abspath(e.path) in keep:
+                continue
+            with open(e.path, "rb") as f:
+                generated = f.read(len(header)) == header
+            if generated:
+                os.unlink(e.path)
+                print(f"Removed {e.path}")
+                removed = True
+    if removed and not os.listdir(split_dir):
+        os.rmdir(split_dir)
+
+
+# Renders `path` through `render`, formats it, and writes it only if its content changed. Rendering
+# happens in a temporary file next to `path`, so that unchanged runs leave `path` and its
+# modification time untouched and don't invalidate forge's compilation cache. Returns whether
+# `path` was written.
+def write_rendered(
+    path: str,
+    render: Callable[["CheatcodesPrinter"], None],
+    printer_options: dict,
+    external_fmt: bool,
+    fmt_cache: "FmtCache | None" = None,
+) -> bool:
+    out_dir = os.path.dirname(path) or "."
+    os.makedirs(out_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=out_dir, prefix=".Vm.", suffix=".sol")
+    try:
+        with os.fdopen(fd, "w") as f:
+            pp = CheatcodesPrinter(sink=f, **printer_options)
+            render(pp)
+            pp.finish("\n" if pp.canonical else "")
+
+        if external_fmt:
+            if fmt_cache is None or not fmt_cache.format(tmp_path):
+                forge_fmt = ["forge", "fmt", tmp_path]
+                res = subprocess.run(forge_fmt)
+                assert res.returncode == 0, f"command failed: {forge_fmt}"
+                if fmt_cache is not None:
+                    fmt_cache.store(tmp_path)
+
+        return replace_if_changed(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+# Finds the names of the cheatcodes called in the .sol files under `paths`, as in `vm.warp(...)`.
+# Files are scanned in parallel, and results are cached by path, size and mtime under `cache_dir`.
+def scan_cheatcode_usage(paths: list[str], receivers: frozenset[str], cache_dir: str, jobs: int = 1) -> set[str]:
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(os.path.abspath(path))
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            files.extend(os.path.abspath(os.path.join(root, n)) for n in sorted(names) if n.endswith(".sol"))
+
+    receivers_key = ",".join(sorted(receivers))
+    cache_path = os.path.join(cache_dir, "usage", hashlib.sha256(receivers_key.encode()).hexdigest()[:16] + ".json")
+    try:
+        with open(cache_path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    used = set()
+    updated = {}
+    todo = []
+    for path in files:
+        st = os.stat(path)
+        entry = cache.get(path)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            used.update(entry[2])
+            updated[path] = entry
+        else:
+            todo.append((path, st))
+
+    if todo:
+        import concurrent.futures
+
+        pool = (
+            concurrent.futures.ProcessPoolExecutor(jobs)
+            if jobs > 1
+            else concurrent.futures.ThreadPoolExecutor(min(32, (os.cpu_count() or 1) + 4))
+        )
+        with pool:
+            results = pool.map(scan_sol_file, [path for path, _ in todo], [receivers_key] * len(todo), chunksize=16)
+            for (path, st), names in zip(todo, results):
+                used.update(names)
+                updated[path] = [st.st_mtime_ns, st.st_size, names]
+        write_atomic(cache_path, json.dumps(updated, separators=(",", ":")).encode())
+    return used
+
+
+# Returns the sorted names called on any of the comma-separated `receivers` in the file at `path`.
+def scan_sol_file(path: str, receivers: str) -> list[str]:
+    pattern = re.compile(r"\b(?:%s)\s*\.\s*([A-Za-z_]\w*)\s*\(" % "|".join(map(re.escape, receivers.split(","))))
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return sorted(set(pattern.findall(f.read())))
+
+
+# Keeps only the cheatcodes whose name is in `used`, with all their overloads, and the enums,
+# structs and events that they reference, directly or through struct fields.
+def prune_cheatcodes(
+    contract: "Cheatcodes",
+    safe: list["Cheatcode"],
+    unsafe: list["Cheatcode"],
+    used: set[str],
+) -> tuple["Cheatcodes", list["Cheatcode"], list["Cheatcode"]]:
+    def name(cc: Cheatcode) -> str:
+        return cc.func.signature.split("(", 1)[0]
+
+    safe = [cc for cc in safe if name(cc) in used]
+    unsafe = [cc for cc in unsafe if name(cc) in used]
+    unknown = used - {name(cc) for cc in contract.cheatcodes}
+    if unknown:
+        print(f"warning: ignoring unknown cheatcodes: {', '.join(sorted(unknown))}", file=sys.stderr)
+
+    identifier = re.compile(r"[A-Za-z_]\w*")
+    structs = {s.name: s for s in contract.structs}
+    referenced = set()
+    todo = [cc.func.declaration for cc in safe + unsafe]
+    while todo:
+        for ident in identifier.findall(todo.pop()):
+            if ident in referenced:
+                continue
+            referenced.add(ident)
+            if ident in structs:
+                todo.extend(field.ty for field in structs[ident].fields)
+
+    pruned = Cheatcodes(
+        errors=[e for e in contract.errors if e.name in referenced],
+        events=[e for e in contract.events if e.name in referenced],
+        enums=[e for e in contract.enums if e.name in referenced],
+        structs=[s for s in contract.structs if s.name in referenced],
+        cheatcodes=safe + unsafe,
     )
-    pp.p_contract(vm_unsafe, "Vm", "VmSafe")
-    out += pp.finish()
+    return pruned, safe, unsafe
+
 
-    # Compatibility with <0.8.0
-    def memory_to_calldata(m: re.Match) -> str:
-        return " calldata " + m.group(1)
+# Atomically moves `tmp_path` over `path` unless both have the same content, in which case `path`,
+# including its modification time, is left untouched. Returns whether `path` was replaced.
+def replace_if_changed(tmp_path: str, path: str) -> bool:
+    try:
+        if filecmp.cmp(tmp_path, path, shallow=False):
+            return False
+    except FileNotFoundError:
+        pass
+    os.chmod(tmp_path, replacement_mode(path))
+    os.replace(tmp_path, path)
+    return True
+
+
+# The mode of a file replacing `path`: the mode of `path` if it exists, and otherwise the mode a
+# newly created file gets. Temporary files from `mkstemp` are only readable by their owner.
+def replacement_mode(path: str) -> int:
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def manifest_path(out_path: str) -> str:
+    head, tail = os.path.split(out_path)
+    return os.path.join(head, f".{tail}.manifest.json")
+
+
+# Describes everything the outputs depend on: the input json, this script and the options that
+# affect rendering. The hashes of the outputs themselves are added by `write_manifest`.
+def build_manifest(input_path: str, options: dict) -> dict:
+    return {
+        "version": MANIFEST_VERSION,
+        "input": file_sha256(input_path),
+        "generator": file_sha256(__file__),
+        "options": options,
+    }
+
+
+# Whether the outputs recorded next to `out_path` were generated from the inputs in `manifest` and
+# haven't been modified since.
+def is_fresh(out_path: str, manifest: dict) -> bool:
+    try:
+        with open(manifest_path(out_path)) as f:
+            recorded = json.load(f)
+    except (OSError, ValueError):
+        return False
+    outputs = recorded.get("outputs")
+    if not outputs or {k: recorded.get(k) for k in manifest} != manifest:
+        return False
+    try:
+        return all(file_sha256(path) == digest for path, digest in outputs.items())
+    except OSError:
+        return False
+
+
+# Records `manifest` next to the last of `outputs`, which is always the main output.
+def write_manifest(manifest: dict, outputs: list[str]):
+    manifest = dict(manifest, outputs={path: file_sha256(path) for path in outputs})
+    write_atomic(manifest_path(outputs[-1]), (json.dumps(manifest, indent=2) + "\n").encode())
+
+
+# Atomically writes `data` to `path`, unless `path` already contains it. Returns whether `path` was
+# written.
+def write_if_changed(path: str, data: bytes) -> bool:
+    dir = os.path.dirname(path) or "."
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return replace_if_changed(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def write_atomic(path: str, data: bytes):
+    dir = os.path.dirname(path) or "."
+    os.makedirs(dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dir, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, replacement_mode(path))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+# Statuses that are never emitted into the generated interfaces by default.
+EXCLUDED_STATUSES = frozenset(["experimental", "internal"])
+
+
+def comma_set(s: str) -> frozenset[str]:
+    return frozenset(x.strip() for x in s.split(",") if x.strip() != "")
+
+
+def comma_ints(s: str) -> list[int]:
+    return [int(x) for x in s.split(",") if x.strip() != ""]
+
+
+# Selects cheatcodes by group, status and safety. An allowlist of `None` allows everything. The
+# statuses in `EXCLUDED_STATUSES` are excluded by default, unless `statuses` lists the ones to allow.
+# `accepts_dict` works on raw JSON so that rejected entries are never turned into objects.
+class CheatcodeFilter:
+    __slots__ = ("groups", "exclude_groups", "statuses", "exclude_statuses", "safety")
 
-    out = re.sub(r" memory (.*returns)", memory_to_calldata, out)
+    groups: frozenset[str] | None
+    exclude_groups: frozenset[str]
+    statuses: frozenset[str] | None
+    exclude_statuses: frozenset[str]
+    safety: frozenset[str] | None
 
-    with open(OUT_PATH, "w") as f:
-        f.write(out)
+    def __init__(
+        self,
+        groups: frozenset[str] | None = None,
+        exclude_groups: frozenset[str] = frozenset(),
+        statuses: frozenset[str] | None = None,
+        exclude_statuses: frozenset[str] | None = None,
+        safety: frozenset[str] | None = None,
+    ):
+        if exclude_statuses is None:
+            exclude_statuses = EXCLUDED_STATUSES if statuses is None else frozenset()
+        self.groups = groups
+        self.exclude_groups = exclude_groups
+        self.statuses = statuses
+        self.exclude_statuses = exclude_statuses
+        self.safety = safety
 
-    forge_fmt = ["forge", "fmt", OUT_PATH]
-    res = subprocess.run(forge_fmt)
-    assert res.returncode == 0, f"command failed: {forge_fmt}"
+    def accepts(self, group: str, status: str, safety: str) -> bool:
+        return (
+            (self.groups is None or group in self.groups)
+            and group not in self.exclude_groups
+            and (self.statuses is None or status in self.statuses)
+            and status not in self.exclude_statuses
+            and (self.safety is None or safety in self.safety)
+        )
 
-    print(f"Wrote to {OUT_PATH}")
+    def accepts_cheatcode(self, cc: "Cheatcode") -> bool:
+        return self.accepts(cc.group, cc.status, cc.safety)
 
+    def accepts_dict(self, d: dict) -> bool:
+        return self.accepts(str(d["group"]), str(d["status"]), str(d["safety"]))
 
-class CmpCheatcode:
-    cheatcode: "Cheatcode"
+    def to_dict(self) -> dict:
+        def opt(s: frozenset[str] | None) -> list[str] | None:
+            return None if s is None else sorted(s)
 
-    def __init__(self, cheatcode: "Cheatcode"):
-        self.cheatcode = cheatcode
+        return {
+            "groups": opt(self.groups),
+            "exclude_groups": opt(self.exclude_groups),
+            "statuses": opt(self.statuses),
+            "exclude_statuses": opt(self.exclude_statuses),
+            "safety": opt(self.safety),
+        }
 
-    def __lt__(self, other: "CmpCheatcode") -> bool:
-        return cmp_cheatcode(self.cheatcode, other.cheatcode) < 0
+    @staticmethod
+    def from_dict(d: dict) -> "CheatcodeFilter":
+        def opt(s: list[str] | None) -> frozenset[str] | None:
+            return None if s is None else frozenset(s)
+
+        return CheatcodeFilter(
+            groups=opt(d.get("groups")),
+            exclude_groups=frozenset(d.get("exclude_groups", ())),
+            statuses=opt(d.get("statuses")),
+            exclude_statuses=opt(d.get("exclude_statuses")),
+            safety=opt(d.get("safety")),
+        )
 
-    def __eq__(self, other: "CmpCheatcode") -> bool:
-        return cmp_cheatcode(self.cheatcode, other.cheatcode) == 0
 
-    def __gt__(self, other: "CmpCheatcode") -> bool:
-        return cmp_cheatcode(self.cheatcode, other.cheatcode) > 0
+DEFAULT_FILTER = CheatcodeFilter()
 
 
-def cmp_cheatcode(a: "Cheatcode", b: "Cheatcode") -> int:
-    if a.group != b.group:
-        return -1 if a.group < b.group else 1
-    if a.status != b.status:
-        return -1 if a.status < b.status else 1
-    if a.safety != b.safety:
-        return -1 if a.safety < b.safety else 1
-    if a.func.id != b.func.id:
-        return -1 if a.func.id < b.func.id else 1
-    return 0
+def cheatcode_sort_key(cc: "Cheatcode") -> tuple[str, str, str, str]:
+    return (cc.group, cc.status, cc.safety, cc.func.id)
 
 
-# HACK: A way to add group header comments without having to modify printer code
-def prefix_with_group_headers(cheats: list["Cheatcode"]):
-    s = set()
-    for i, cheat in enumerate(cheats):
-        if cheat.group in s:
+# Splits `ccs` into sorted `(safe, unsafe)` lists in a single pass, dropping rejected cheatcodes.
+def partition_cheatcodes(
+    ccs: list["Cheatcode"],
+    filter: CheatcodeFilter = DEFAULT_FILTER,
+) -> tuple[list["Cheatcode"], list["Cheatcode"]]:
+    safe = []
+    unsafe = []
+    for cc in ccs:
+        if not filter.accepts_cheatcode(cc):
             continue
+        if cc.safety == "safe":
+            safe.append(cc)
+        elif cc.safety == "unsafe":
+            unsafe.append(cc)
+        else:
+            assert False, f"unknown safety {cc.safety!r} for {cc.func.id}"
+    safe.sort(key=cheatcode_sort_key)
+    unsafe.sort(key=cheatcode_sort_key)
+    return safe, unsafe
+
+
+class GroupHeader:
+    __slots__ = ("group",)
+
+    group: str
+
+    def __init__(self, group: str):
+        self.group = group
 
-        s.add(cheat.group)
 
-        c = copy.deepcopy(cheat)
-        c.func.description = ""
-        c.func.declaration = f"// ======== {group(c.group)} ========"
-        cheats.insert(i, c)
-    return cheats
+# Yields a `GroupHeader` before the first cheatcode of each group.
+def with_group_headers(cheats: list["Cheatcode"]) -> Iterator["Cheatcode | GroupHeader"]:
+    seen = set()
+    for cheat in cheats:
+        if cheat.group not in seen:
+            seen.add(cheat.group)
+            yield GroupHeader(cheat.group)
+        yield cheat
+
+
+def group_title(s: str) -> str:
+    return s[0].upper() + s[1:]
 
 
 def group(s: str) -> str:
@@ -177,15 +1796,153 @@ class Mutability(PyEnum):
         return self.value
 
 
+# Equivalent to `re.sub(r" memory (.*returns)", r" calldata \1", decl)`: the first ` memory ` of a
+# line is rewritten if `returns` appears after it on that line.
+def memory_to_calldata(decl: str) -> str:
+    if "\n" in decl:
+        return "\n".join(map(memory_to_calldata, decl.split("\n")))
+    i = decl.find(" memory ")
+    if i == -1 or decl.rfind("returns") < i + len(" memory "):
+        return decl
+    return decl[:i] + " calldata " + decl[i + len(" memory "):]
+
+
+KECCAK_ROUND_CONSTANTS = (
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+)
+# Rotation of lane (x, y), indexed as [x][y].
+KECCAK_ROTATIONS = (
+    (0, 36, 3, 41, 18),
+    (1, 44, 10, 45, 2),
+    (62, 6, 43, 15, 61),
+    (28, 55, 25, 21, 56),
+    (27, 20, 39, 8, 14),
+)
+# Lanes are indexed as `x + 5 * y`. For every lane after the rho and pi steps: the lane it comes
+# from, and by how much that lane is rotated.
+KECCAK_RHO_PI = tuple(
+    sorted(
+        (y + 5 * ((2 * x + 3 * y) % 5), x + 5 * y, KECCAK_ROTATIONS[x][y])
+        for x in range(5)
+        for y in range(5)
+    )
+)
+# For every lane, the two lanes the chi step combines it with.
+KECCAK_CHI = tuple((i, i - i % 5 + (i + 1) % 5, i - i % 5 + (i + 2) % 5) for i in range(25))
+# Rate of keccak256 in bytes.
+KECCAK_RATE = 136
+# Messages hashed together by `keccak256_batch`. Larger batches spend less time in the interpreter,
+# but stop fitting in the CPU caches.
+KECCAK_BATCH = 4096
+
+
+# keccak256, as used by Solidity for selectors. Neither `hashlib` nor OpenSSL provide it: their
+# SHA3-256 uses a different padding.
+def keccak256(data: bytes) -> bytes:
+    return keccak256_batch([data])[0]
+
+
+# Hashes many messages at once. The permutation runs on all messages of a batch together: lane `i`
+# of every message is packed into a single integer with one 64-bit slot per message, so that every
+# XOR, AND or shift of the permutation processes the whole batch in a single operation.
+def keccak256_batch(messages: list[bytes]) -> list[bytes]:
+    digests: list[bytes] = [b""] * len(messages)
+    by_blocks: dict[int, list[int]] = {}
+    for i, m in enumerate(messages):
+        by_blocks.setdefault(len(m) // KECCAK_RATE + 1, []).append(i)
+    for blocks, indices in by_blocks.items():
+        for start in range(0, len(indices), KECCAK_BATCH):
+            batch = indices[start:start + KECCAK_BATCH]
+            padded = []
+            for i in batch:
+                p = bytearray(messages[i])
+                p.append(0x01)
+                p.extend(bytes(-len(p) % KECCAK_RATE))
+                p[-1] |= 0x80
+                padded.append(bytes(p))
+            state = [0] * 25
+            for offset in range(0, blocks * KECCAK_RATE, KECCAK_RATE):
+                for lane in range(KECCAK_RATE // 8):
+                    o = offset + 8 * lane
+                    state[lane] ^= int.from_bytes(b"".join([p[o:o + 8] for p in padded]), "little")
+                state = keccak_f_batch(state, len(batch))
+            lanes = [v.to_bytes(8 * len(batch), "little") for v in state[:4]]
+            for k, i in enumerate(batch):
+                digests[i] = b"".join([lane[8 * k:8 * k + 8] for lane in lanes])
+    return digests
+
+
+# Masks used by `keccak_f_batch` for batches of `n` messages: all ones, the round constants, and for
+# every rotation `r`, the bits that stay in their slot when shifted left by `r` and the ones that
+# wrap around.
+@functools.lru_cache(maxsize=4)
+def keccak_batch_masks(n: int) -> tuple[int, tuple[int, ...], dict[int, tuple[int, int]]]:
+    def spread(lane: int) -> int:
+        return int.from_bytes(lane.to_bytes(8, "little") * n, "little")
+
+    ones = spread((1 << 64) - 1)
+    round_constants = tuple(spread(rc) for rc in KECCAK_ROUND_CONSTANTS)
+    rotations = {}
+    for r in {1} | {r for _, _, r in KECCAK_RHO_PI}:
+        wrapped = spread((1 << r) - 1)
+        rotations[r] = (ones ^ wrapped, wrapped)
+    return ones, round_constants, rotations
+
+
+# keccak-f[1600] on a batch of `n` states, in the layout of `keccak256_batch`.
+def keccak_f_batch(a: list[int], n: int) -> list[int]:
+    ones, round_constants, rotations = keccak_batch_masks(n)
+    kept_1, wrapped_1 = rotations[1]
+    rho_pi = tuple((src, r, 64 - r, *rotations[r]) for _, src, r in KECCAK_RHO_PI)
+    for rc in round_constants:
+        c0 = a[0] ^ a[5] ^ a[10] ^ a[15] ^ a[20]
+        c1 = a[1] ^ a[6] ^ a[11] ^ a[16] ^ a[21]
+        c2 = a[2] ^ a[7] ^ a[12] ^ a[17] ^ a[22]
+        c3 = a[3] ^ a[8] ^ a[13] ^ a[18] ^ a[23]
+        c4 = a[4] ^ a[9] ^ a[14] ^ a[19] ^ a[24]
+        d = (
+            c4 ^ ((c1 << 1) & kept_1) ^ ((c1 >> 63) & wrapped_1),
+            c0 ^ ((c2 << 1) & kept_1) ^ ((c2 >> 63) & wrapped_1),
+            c1 ^ ((c3 << 1) & kept_1) ^ ((c3 >> 63) & wrapped_1),
+            c2 ^ ((c4 << 1) & kept_1) ^ ((c4 >> 63) & wrapped_1),
+            c3 ^ ((c0 << 1) & kept_1) ^ ((c0 >> 63) & wrapped_1),
+        ) * 5
+        a = [v ^ dv for v, dv in zip(a, d)]
+        b = [((a[s] << r) & kept) | ((a[s] >> l) & wrapped) if r else a[s] for s, r, l, kept, wrapped in rho_pi]
+        a = [b[i] ^ ((b[j] ^ ones) & b[k]) for i, j, k in KECCAK_CHI]
+        a[0] ^= rc
+    return a
+
+
 class Function:
+    __slots__ = (
+        "id",
+        "description",
+        "declaration",
+        "visibility",
+        "mutability",
+        "signature",
+        "selector_int",
+        "selector_error",
+        "_calldata_declaration",
+    )
+
     id: str
     description: str
     declaration: str
     visibility: Visibility
     mutability: Mutability
     signature: str
-    selector: str
-    selector_bytes: bytes
+    selector_int: int
+    # How the spec's `selector` disagrees with its `selectorBytes`, if it does. `selector_int` comes
+    # from `selectorBytes`. Reported by `verify_selectors`.
+    selector_error: str | None
+    _calldata_declaration: str | None
 
     def __init__(
         self,
@@ -195,8 +1952,8 @@ class Function:
         visibility: Visibility,
         mutability: Mutability,
         signature: str,
-        selector: str,
-        selector_bytes: bytes,
+        selector_int: int,
+        selector_error: str | None = None,
     ):
         self.id = id
         self.description = description
@@ -204,8 +1961,24 @@ class Function:
         self.visibility = visibility
         self.mutability = mutability
         self.signature = signature
-        self.selector = selector
-        self.selector_bytes = selector_bytes
+        self.selector_int = selector_int
+        self.selector_error = selector_error
+        self._calldata_declaration = None
+
+    # The declaration with its first `memory` parameter turned into `calldata`, for compatibility
+    # with <0.8.0. Computed once and cached.
+    def calldata_declaration(self) -> str:
+        if self._calldata_declaration is None:
+            self._calldata_declaration = memory_to_calldata(self.declaration)
+        return self._calldata_declaration
+
+    @property
+    def selector(self) -> str:
+        return f"0x{self.selector_int:08x}"
+
+    @property
+    def selector_bytes(self) -> bytes:
+        return self.selector_int.to_bytes(4, "big")
 
     @staticmethod
     def from_dict(d: dict) -> "Function":
@@ -216,12 +1989,26 @@ class Function:
             Visibility(d["visibility"]),
             Mutability(d["mutability"]),
             d["signature"],
-            d["selector"],
-            bytes(d["selectorBytes"]),
+            *Function.selector_from_dict(d),
         )
 
+    # The selector, from `selectorBytes`, and the `selector_error` if its hex form disagrees with it.
+    @staticmethod
+    def selector_from_dict(d: dict) -> tuple[int, str | None]:
+        selector_bytes = bytes(d["selectorBytes"])
+        selector = int.from_bytes(selector_bytes, "big")
+        try:
+            consistent = len(selector_bytes) == 4 and int(d["selector"], 16) == selector
+        except ValueError:
+            consistent = False
+        if consistent:
+            return selector, None
+        return selector, f"selector {d['selector']} doesn't match selectorBytes 0x{selector_bytes.hex()}"
+
 
 class Cheatcode:
+    __slots__ = ("func", "group", "status", "safety")
+
     func: Function
     group: str
     status: str
@@ -229,9 +2016,10 @@ class Cheatcode:
 
     def __init__(self, func: Function, group: str, status: str, safety: str):
         self.func = func
-        self.group = group
-        self.status = status
-        self.safety = safety
+        # These come from a handful of values, so share a single string object per value.
+        self.group = sys.intern(group)
+        self.status = sys.intern(status)
+        self.safety = sys.intern(safety)
 
     @staticmethod
     def from_dict(d: dict) -> "Cheatcode":
@@ -244,6 +2032,8 @@ class Cheatcode:
 
 
 class Error:
+    __slots__ = ("name", "description", "declaration")
+
     name: str
     description: str
     declaration: str
@@ -259,6 +2049,8 @@ class Error:
 
 
 class Event:
+    __slots__ = ("name", "description", "declaration")
+
     name: str
     description: str
     declaration: str
@@ -274,6 +2066,8 @@ class Event:
 
 
 class EnumVariant:
+    __slots__ = ("name", "description")
+
     name: str
     description: str
 
@@ -283,6 +2077,8 @@ class EnumVariant:
 
 
 class Enum:
+    __slots__ = ("name", "description", "variants")
+
     name: str
     description: str
     variants: list[EnumVariant]
@@ -302,17 +2098,21 @@ class Enum:
 
 
 class StructField:
+    __slots__ = ("name", "ty", "description")
+
     name: str
     ty: str
     description: str
 
     def __init__(self, name: str, ty: str, description: str):
         self.name = name
-        self.ty = ty
+        self.ty = sys.intern(ty)
         self.description = description
 
 
 class Struct:
+    __slots__ = ("name", "description", "fields")
+
     name: str
     description: str
     fields: list[StructField]
@@ -332,6 +2132,8 @@ class Struct:
 
 
 class Cheatcodes:
+    __slots__ = ("errors", "events", "enums", "structs", "cheatcodes")
+
     errors: list[Error]
     events: list[Event]
     enums: list[Enum]
@@ -352,24 +2154,982 @@ class Cheatcodes:
         self.structs = structs
         self.cheatcodes = cheatcodes
 
+    # Cheatcodes rejected by `filter` are skipped before they are turned into objects.
     @staticmethod
-    def from_dict(d: dict) -> "Cheatcodes":
+    def from_dict(d: dict, filter: CheatcodeFilter | None = None) -> "Cheatcodes":
         return Cheatcodes(
             errors=[Error.from_dict(e) for e in d["errors"]],
             events=[Event.from_dict(e) for e in d["events"]],
             enums=[Enum.from_dict(e) for e in d["enums"]],
             structs=[Struct.from_dict(e) for e in d["structs"]],
-            cheatcodes=[Cheatcode.from_dict(e) for e in d["cheatcodes"]],
+            cheatcodes=[
+                Cheatcode.from_dict(e)
+                for e in d["cheatcodes"]
+                if filter is None or filter.accepts_dict(e)
+            ],
+        )
+
+    @staticmethod
+    def from_json(s, filter: CheatcodeFilter | None = None) -> "Cheatcodes":
+        return Cheatcodes.from_dict(json.loads(s), filter)
+
+    @staticmethod
+    def from_json_file(file_path: str, filter: CheatcodeFilter | None = None) -> "Cheatcodes":
+        with open(file_path, "rb") as f:
+            return Cheatcodes.from_json_stream(f, filter)
+
+    @staticmethod
+    def from_json_stream(stream: "io.IOBase", filter: CheatcodeFilter | None = None) -> "Cheatcodes":
+        sections = {section: [] for section in CHEATCODES_SECTIONS}
+        for section, item in Cheatcodes.iter_json_stream(stream, filter):
+            sections[section].append(item)
+        return Cheatcodes(**sections)
+
+    # Yields `(section, item)` pairs, e.g. `("cheatcodes", Cheatcode)`, while reading `stream`
+    # incrementally. Only one item's JSON is held in memory at a time.
+    @staticmethod
+    def iter_json_stream(
+        stream: "io.IOBase",
+        filter: CheatcodeFilter | None = None,
+    ) -> Iterator[tuple[str, "Error | Event | Enum | Struct | Cheatcode"]]:
+        for section, d in JsonArrayStream(stream):
+            cls = CHEATCODES_SECTIONS.get(section)
+            if cls is None:
+                continue
+            if cls is Cheatcode and filter is not None and not filter.accepts_dict(d):
+                continue
+            yield section, cls.from_dict(d)
+
+
+CHEATCODES_SECTIONS: dict[str, type] = {
+    "errors": Error,
+    "events": Event,
+    "enums": Enum,
+    "structs": Struct,
+    "cheatcodes": Cheatcode,
+}
+
+
+# Incremental reader for a top-level JSON object whose values are arrays, such as
+# `cheatcodes.json`. Iterating yields `(key, element)` for every array element, decoding one element
+# at a time from a text or binary stream. Non-array values are skipped.
+class JsonArrayStream:
+    _WS = " \t\n\r"
+    _DELIMITERS = ",]}" + _WS
+    _NUMBER_START = "-0123456789"
+
+    stream: "io.IOBase"
+    chunk_size: int
+    _decoder: json.JSONDecoder
+    _utf8: "codecs.IncrementalDecoder | None"
+    _buf: str
+    _pos: int
+    _eof: bool
+
+    def __init__(self, stream: "io.IOBase", chunk_size: int = 1 << 16):
+        assert chunk_size > 0
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._utf8 = None
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self) -> Iterator[tuple[str, object]]:
+        self._expect("{")
+        if self._peek() == "}":
+            return
+        while True:
+            key = self._value()
+            assert isinstance(key, str), f"expected an object key, got {key!r}"
+            self._expect(":")
+            if self._peek() == "[":
+                self._pos += 1
+                if self._peek() == "]":
+                    self._pos += 1
+                else:
+                    while True:
+                        yield key, self._value()
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                self._value()
+            if self._expect(",}") == "}":
+                return
+
+    def _fill(self, size: int) -> bool:
+        if self._eof:
+            return False
+        chunk = self.stream.read(size)
+        self._eof = not chunk
+        if isinstance(chunk, bytes):
+            if self._utf8 is None:
+                self._utf8 = codecs.getincrementaldecoder("utf-8")()
+            chunk = self._utf8.decode(chunk, final=self._eof)
+        # Drop everything that was already consumed.
+        self._buf = self._buf[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def _peek(self) -> str:
+        while True:
+            buf = self._buf
+            pos = self._pos
+            n = len(buf)
+            while pos < n and buf[pos] in self._WS:
+                pos += 1
+            self._pos = pos
+            if pos < n:
+                return buf[pos]
+            if not self._fill(self.chunk_size):
+                return ""
+
+    def _expect(self, chars: str) -> str:
+        c = self._peek()
+        if c == "" or c not in chars:
+            raise ValueError(f"malformed cheatcodes JSON: expected one of {chars!r}, got {c!r}")
+        self._pos += 1
+        return c
+
+    def _value(self) -> object:
+        self._peek()
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # A number may continue in the next chunk: `1.` can be the start of `1.25`. It's only
+                # complete once the delimiter after it has been read. Other values end unambiguously.
+                if (
+                    self._eof
+                    or self._buf[self._pos] not in self._NUMBER_START
+                    or (end < len(self._buf) and self._buf[end] in self._DELIMITERS)
+                ):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # Grow reads geometrically so that items larger than a chunk stay linear to parse.
+            self._fill(size)
+            size *= 2
+
+
+def default_cache_dir() -> str:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "forge-std", "vm")
+
+
+# Names the state kept in the shared cache directory for one project, such as its rendered fragments
+# and `serve` socket, after the absolute path of its output.
+def output_key(out_path: str = OUT_PATH) -> str:
+    return hashlib.sha256(os.path.abspath(out_path).encode()).hexdigest()[:16]
+
+
+# Content-addressed cache for downloaded cheatcode specs.
+#
+# Bodies are stored once under `objects/<sha256>`. Each URL has a small JSON ref under
+# `refs/<sha256(url)>.json` that points at its last good body together with the `ETag` and
+# `Last-Modified` headers, which are sent back as a conditional GET on the next fetch.
+class SpecCache:
+    root: str
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest)
+
+    def ref_path(self, url: str) -> str:
+        return os.path.join(self.root, "refs", hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def read_ref(self, url: str) -> dict | None:
+        try:
+            with open(self.ref_path(url)) as f:
+                ref = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.isfile(self.object_path(ref["sha256"])):
+            return None
+        return ref
+
+    # Returns the path of an up-to-date copy of `url`, downloading it only if it changed. With
+    # `offline`, or if the server can't be reached, the last good copy is used instead.
+    def fetch(self, url: str, offline: bool = False, timeout: float = 30.0) -> str:
+        ref = self.read_ref(url)
+        if offline:
+            assert ref is not None, f"no cached copy of {url} in {self.root}"
+            return self.object_path(ref["sha256"])
+
+        from urllib import error, request
+
+        req = request.Request(url, headers={"Accept-Encoding": "gzip"})
+        if ref is not None:
+            if ref.get("etag"):
+                req.add_header("If-None-Match", ref["etag"])
+            if ref.get("last_modified"):
+                req.add_header("If-Modified-Since", ref["last_modified"])
+
+        try:
+            with request.urlopen(req, timeout=timeout) as res:
+                gzipped = res.headers.get("Content-Encoding", "").lower() == "gzip"
+                digest = self._store(res, gzipped)
+                ref = {
+                    "url": url,
+                    "sha256": digest,
+                    "etag": res.headers.get("ETag"),
+                    "last_modified": res.headers.get("Last-Modified"),
+                }
+        except error.HTTPError as e:
+            if e.code != 304 or ref is None:
+                raise
+            return self.object_path(ref["sha256"])
+        except (error.URLError, TimeoutError) as e:
+            if ref is None:
+                raise
+            print(f"warning: could not fetch {url} ({e}), using cached copy", file=sys.stderr)
+            return self.object_path(ref["sha256"])
+
+        write_atomic(self.ref_path(url), json.dumps(ref).encode())
+        return self.object_path(digest)
+
+    # Streams `res` into the object store, decompressing it if needed, and returns its digest.
+    def _store(self, res: "io.IOBase", gzipped: bool) -> str:
+        objects = os.path.join(self.root, "objects")
+        os.makedirs(objects, exist_ok=True)
+        h = hashlib.sha256()
+        z = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        fd, tmp = tempfile.mkstemp(dir=objects, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                while chunk := res.read(1 << 16):
+                    if z is not None:
+                        chunk = z.decompress(chunk)
+                    h.update(chunk)
+                    f.write(chunk)
+                if z is not None:
+                    chunk = z.flush()
+                    h.update(chunk)
+                    f.write(chunk)
+            digest = h.hexdigest()
+            os.chmod(tmp, replacement_mode(self.object_path(digest)))
+            os.replace(tmp, self.object_path(digest))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return digest
+
+
+# Size-bounded LRU cache of `forge fmt` results, keyed by the unformatted content, the `forge`
+# version and the project's `foundry.toml`. Entries are written atomically and recency is tracked
+# through their mtime, so that several processes can share one cache directory.
+class FmtCache:
+    DEFAULT_MAX_BYTES = 64 << 20
+
+    root: str
+    max_bytes: int
+    _key: str | None
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._key = None
+
+    # Replaces the content of `path` with its cached formatted version. Returns whether there was
+    # one; on a miss, the key is remembered for a following call to `store`.
+    def format(self, path: str) -> bool:
+        with open(path, "rb") as f:
+            unformatted = f.read()
+        h = hashlib.sha256()
+        h.update(self.forge_version().encode())
+        h.update(b"\0")
+        try:
+            h.update(file_sha256("foundry.toml").encode())
+        except OSError:
+            pass
+        h.update(b"\0")
+        h.update(unformatted)
+        self._key = h.hexdigest()
+
+        entry = os.path.join(self.root, self._key + ".sol")
+        try:
+            with open(entry, "rb") as f:
+                formatted = f.read()
+            os.utime(entry)
+        except OSError:
+            return False
+        with open(path, "wb") as f:
+            f.write(formatted)
+        return True
+
+    # Stores the formatted content of `path` under the key computed by the last `format` call.
+    def store(self, path: str):
+        assert self._key is not None, "`format` must be called first"
+        with open(path, "rb") as f:
+            write_atomic(os.path.join(self.root, self._key + ".sol"), f.read())
+        self._key = None
+        self.evict()
+
+    # Removes the least recently used entries until the cache fits in `max_bytes`.
+    def evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.root) as it:
+            for e in it:
+                if not e.name.endswith(".sol"):
+                    continue
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime_ns, st.st_size, e.path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    # `forge --version`, memoized on the identity of the `forge` binary so that a cache hit doesn't
+    # have to spawn it.
+    def forge_version(self) -> str:
+        forge = shutil.which("forge")
+        assert forge is not None, "`forge` not found"
+        st = os.stat(forge)
+        binary = f"{os.path.realpath(forge)}:{st.st_size}:{st.st_mtime_ns}"
+        memo = os.path.join(self.root, "forge-version-" + hashlib.sha256(binary.encode()).hexdigest()[:16])
+        try:
+            with open(memo) as f:
+                return f.read()
+        except OSError:
+            pass
+        res = subprocess.run(["forge", "--version"], capture_output=True, text=True)
+        assert res.returncode == 0, "command failed: forge --version"
+        version = res.stdout.strip()
+        write_atomic(memo, version.encode())
+        return version
+
+
+# On-disk cache of rendered items, so that regenerating after a small spec change only renders the
+# items that changed. Entries are keyed by a digest of the item, of the printer state it was
+# rendered with and of this script, so that fragments rendered by another version of the printer are
+# never reused. Saving keeps only the entries used since loading, which drops stale fragments.
+class FragmentCache:
+    # Where the cache is saved, or `None` to keep it in memory only.
+    path: str | None
+    # `file_sha256` of this script.
+    generator: str
+    hits: int
+    misses: int
+    _entries: dict[str, str]
+    _used: dict[str, str]
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.generator = file_sha256(__file__)
+        self.hits = 0
+        self.misses = 0
+        self._used = {}
+        self._entries = {}
+        if path is not None:
+            try:
+                with open(path) as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError):
+                pass
+
+    def digest(self, key: tuple[str, ...]) -> str:
+        return hashlib.sha256("\0".join((self.generator,) + key).encode()).hexdigest()[:32]
+
+    def get(self, digest: str) -> str | None:
+        fragment = self._entries.get(digest)
+        if fragment is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._used[digest] = fragment
+        return fragment
+
+    def put(self, digest: str, fragment: str):
+        self._entries[digest] = fragment
+        self._used[digest] = fragment
+
+    def save(self):
+        if self.path is not None:
+            write_atomic(self.path, json.dumps(self._used, separators=(",", ":")).encode())
+        # Later runs in the same process, with `watch`, start from the fragments used by this one.
+        self._entries, self._used = self._used, {}
+
+
+# Snapshot of the parsed model: the cheatcodes as filtered, sorted and partitioned for one input and
+# filter, so that later runs skip parsing the json. Snapshots live under `snapshots/` in the cache,
+# keyed by the input, the filter, this script and the Python version.
+#
+# The file is `HEADER` (magic, format version and the SHA-256 of the payload) followed by the
+# payload: the model as compact json arrays of strings, integers and nulls, one array per record.
+# Loading checks the type of every field before calling the model constructors, and rejects the
+# snapshot on any mismatch, so a damaged or crafted file is never more than a cache miss. The digest
+# is unkeyed: it detects truncated or corrupted files, not tampering.
+class ModelSnapshot:
+    MAGIC = b"VMSNAP\0\0"
+    VERSION = 3
+    HEADER = struct.Struct("<8sI32s")
+
+    # The field types each kind of record in the payload may have.
+    MODEL = {(list, list, list, list, list, list, list, bool)}
+    ITEM = {(str, str, str)}
+    NESTED = {(str, str, list)}
+    VARIANT = {(str, str)}
+    FIELD = {(str, str, str)}
+    CHEATCODE = {
+        (str, str, str, str, str, str, int, str, str, str, str),
+        (str, str, str, str, str, str, int, type(None), str, str, str),
+    }
+
+    path: str
+
+    def __init__(self, cache_dir: str, input_digest: str, generator_digest: str, filter: CheatcodeFilter):
+        key = {
+            "input": input_digest,
+            "generator": generator_digest,
+            "filter": filter.to_dict(),
+            "python": list(sys.version_info[:2]),
+        }
+        digest = hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        self.path = os.path.join(cache_dir, "snapshots", digest + ".bin")
+
+    # Returns `(contract, safe, unsafe, verified)`, or `None` if there is no valid snapshot. `verified`
+    # is whether the selectors were verified before the snapshot was saved.
+    def load(self) -> tuple["Cheatcodes", list["Cheatcode"], list["Cheatcode"], bool] | None:
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        return ModelSnapshot.decode(data)
+
+    def save(self, contract: "Cheatcodes", safe: list["Cheatcode"], unsafe: list["Cheatcode"], verified: bool):
+        write_atomic(self.path, ModelSnapshot.encode(contract, safe, unsafe, verified))
+
+    @staticmethod
+    def encode(contract: "Cheatcodes", safe: list["Cheatcode"], unsafe: list["Cheatcode"], verified: bool) -> bytes:
+        index = {id(cc): i for i, cc in enumerate(contract.cheatcodes)}
+        model = [
+            [[e.name, e.description, e.declaration] for e in contract.errors],
+            [[e.name, e.description, e.declaration] for e in contract.events],
+            [[e.name, e.description, [[v.name, v.description] for v in e.variants]] for e in contract.enums],
+            [[s.name, s.description, [[f.name, f.ty, f.description] for f in s.fields]] for s in contract.structs],
+            [
+                [
+                    cc.func.id,
+                    cc.func.description,
+                    cc.func.declaration,
+                    cc.func.visibility.value,
+                    cc.func.mutability.value,
+                    cc.func.signature,
+                    cc.func.selector_int,
+                    cc.func.selector_error,
+                    cc.group,
+                    cc.status,
+                    cc.safety,
+                ]
+                for cc in contract.cheatcodes
+            ],
+            [index[id(cc)] for cc in safe],
+            [index[id(cc)] for cc in unsafe],
+            verified,
+        ]
+        payload = json.dumps(model, ensure_ascii=False, separators=(",", ":")).encode()
+        header = ModelSnapshot.HEADER.pack(ModelSnapshot.MAGIC, ModelSnapshot.VERSION, hashlib.sha256(payload).digest())
+        return header + payload
+
+    @staticmethod
+    def decode(data: bytes) -> tuple["Cheatcodes", list["Cheatcode"], list["Cheatcode"], bool] | None:
+        header = ModelSnapshot.HEADER
+        if len(data) < header.size:
+            return None
+        magic, version, digest = header.unpack_from(data)
+        if (magic, version) != (ModelSnapshot.MAGIC, ModelSnapshot.VERSION):
+            return None
+        payload = memoryview(data)[header.size:]
+        if hashlib.sha256(payload).digest() != digest:
+            return None
+        try:
+            model = json.loads(bytes(payload))
+        except ValueError:
+            return None
+        if not ModelSnapshot.is_valid(model):
+            return None
+        errors, events, enums, structs, cheatcodes, safe, unsafe, verified = model
+        try:
+            cheatcodes = [
+                Cheatcode(Function(*f[:3], Visibility(f[3]), Mutability(f[4]), *f[5:8]), *f[8:])
+                for f in cheatcodes
+            ]
+        except ValueError:
+            return None
+        contract = Cheatcodes(
+            errors=[Error(*e) for e in errors],
+            events=[Event(*e) for e in events],
+            enums=[Enum(name, doc, [EnumVariant(*v) for v in variants]) for name, doc, variants in enums],
+            structs=[Struct(name, doc, [StructField(*f) for f in fields]) for name, doc, fields in structs],
+            cheatcodes=cheatcodes,
+        )
+        safe = [cheatcodes[i] for i in safe]
+        unsafe = [cheatcodes[i] for i in unsafe]
+        return contract, safe, unsafe, verified
+
+    # Whether the decoded payload `model` has the shape written by `encode`, with every field of the
+    # expected type. Booleans are not accepted as integers.
+    @staticmethod
+    def is_valid(model) -> bool:
+        def shapes(records) -> set:
+            return {tuple(map(type, r)) if type(r) is list else None for r in records}
+
+        if shapes([model]) != ModelSnapshot.MODEL:
+            return False
+        errors, events, enums, structs, cheatcodes, safe, unsafe, _ = model
+        n = len(cheatcodes)
+        return (
+            shapes(errors) | shapes(events) <= ModelSnapshot.ITEM
+            and shapes(enums) | shapes(structs) <= ModelSnapshot.NESTED
+            and shapes(v for e in enums for v in e[2]) <= ModelSnapshot.VARIANT
+            and shapes(f for s in structs for f in s[2]) <= ModelSnapshot.FIELD
+            and shapes(cheatcodes) <= ModelSnapshot.CHEATCODE
+            and all(type(i) is int and 0 <= i < n for i in safe + unsafe)
         )
 
+
+# Loads the model of the cheatcodes json at `path`: its cheatcodes accepted by `filter`, and the safe
+# and unsafe ones, sorted. Uses, or creates, a snapshot in `cache_dir` unless it's `None`.
+def load_model(
+    path: str,
+    filter: CheatcodeFilter = DEFAULT_FILTER,
+    cache_dir: str | None = None,
+) -> tuple["Cheatcodes", list["Cheatcode"], list["Cheatcode"]]:
+    snapshot = None
+    if cache_dir is not None:
+        snapshot = ModelSnapshot(cache_dir, file_sha256(path), file_sha256(__file__), filter)
+        model = snapshot.load()
+        if model is not None:
+            return model[:3]
+    contract = Cheatcodes.from_json_file(path, filter)
+    safe, unsafe = partition_cheatcodes(contract.cheatcodes, filter)
+    if snapshot is not None:
+        snapshot.save(contract, safe, unsafe, verified=False)
+    return contract, safe, unsafe
+
+
+# Read-only view of a selector database written by `--selector-db`, for tools that decode cheatcode
+# calls. Opening maps the file without parsing it, and lookups binary search the mapped selectors.
+#
+# The file is little-endian, and laid out as:
+# - header: `SELECTOR_DB_MAGIC`, version, number of cheatcodes `n`, offset of the records and offset
+#   of the strings, as in `HEADER`;
+# - selectors: `n` sorted u32 selectors;
+# - records: for the cheatcode of every selector, in the same order, the offset and length in the
+#   strings of its signature, group, safety and declaration, as in `RECORD`;
+# - strings: UTF-8 text, with every distinct string stored once.
+class SelectorDatabase:
+    MAGIC = b"VMSELDB\0"
+    VERSION = 1
+    HEADER = struct.Struct("<8sIIII")
+    RECORD = struct.Struct("<8I")
+    SPAN = struct.Struct("<II")
+
+    count: int
+    _mmap: mmap.mmap
+    _view: memoryview
+    _selectors: "memoryview | list[int]"
+    # Offsets of the records and of the strings in the file.
+    _records: int
+    _strings: int
+    # Signatures decoded so far, by selector.
+    _signatures: dict[int, str]
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self._records, strings = self.HEADER.unpack_from(self._mmap)
+        assert magic == self.MAGIC, f"{path} is not a selector database"
+        assert version == self.VERSION, f"{path} has version {version}, expected {self.VERSION}"
+        self._view = memoryview(self._mmap)
+        selectors = self._view[self.HEADER.size:self.HEADER.size + 4 * self.count]
+        if sys.byteorder == "little":
+            self._selectors = selectors.cast("I")
+        else:
+            self._selectors = [int.from_bytes(selectors[i:i + 4], "little") for i in range(0, len(selectors), 4)]
+        self._strings = strings
+        self._signatures = {}
+
+    def __enter__(self) -> "SelectorDatabase":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if isinstance(self._selectors, memoryview):
+            self._selectors.release()
+        self._view.release()
+        self._mmap.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, selector: "int | bytes") -> bool:
+        return self._index(selector) is not None
+
+    def _index(self, selector: "int | bytes") -> int | None:
+        if isinstance(selector, (bytes, bytearray)):
+            selector = int.from_bytes(selector[:4], "big")
+        i = bisect_left(self._selectors, selector)
+        if i < self.count and self._selectors[i] == selector:
+            return i
+        return None
+
+    def _string(self, i: int, field: int) -> str:
+        start, length = self.SPAN.unpack_from(self._mmap, self._records + self.RECORD.size * i + 8 * field)
+        start += self._strings
+        return str(self._view[start:start + length], "utf-8")
+
+    # The signature of the cheatcode with `selector`, such as `warp(uint256)`, given as an integer or
+    # as bytes starting with the selector, such as calldata. Traces call few distinct cheatcodes
+    # many times, so found signatures are kept decoded.
+    def signature(self, selector: "int | bytes") -> str | None:
+        if not isinstance(selector, int):
+            selector = int.from_bytes(selector[:4], "big")
+        signature = self._signatures.get(selector)
+        if signature is None:
+            i = self._index(selector)
+            if i is None:
+                return None
+            signature = self._signatures[selector] = self._string(i, 0)
+        return signature
+
+    # `(signature, group, safety, declaration)` of the cheatcode with `selector`.
+    def lookup(self, selector: "int | bytes") -> tuple[str, str, str, str] | None:
+        i = self._index(selector)
+        if i is None:
+            return None
+        return self._string(i, 0), self._string(i, 1), self._string(i, 2), self._string(i, 3)
+
     @staticmethod
-    def from_json(s) -> "Cheatcodes":
-        return Cheatcodes.from_dict(json.loads(s))
+    def build(cheats: list["Cheatcode"]) -> bytes:
+        cheats = sorted(cheats, key=lambda cc: cc.func.selector_int)
+        strings = io.BytesIO()
+        offsets: dict[str, tuple[int, int]] = {}
+
+        def add(s: str) -> tuple[int, int]:
+            offset = offsets.get(s)
+            if offset is None:
+                data = s.encode()
+                offset = offsets[s] = (strings.tell(), len(data))
+                strings.write(data)
+            return offset
+
+        header = SelectorDatabase.HEADER
+        record = SelectorDatabase.RECORD
+        selectors = b"".join(cc.func.selector_int.to_bytes(4, "little") for cc in cheats)
+        records = bytearray(record.size * len(cheats))
+        for i, cc in enumerate(cheats):
+            func = cc.func
+            record.pack_into(
+                records,
+                record.size * i,
+                *add(func.signature),
+                *add(cc.group),
+                *add(cc.safety),
+                *add(func.declaration),
+            )
+        records_offset = header.size + len(selectors)
+        strings_offset = records_offset + len(records)
+        return b"".join([
+            header.pack(SelectorDatabase.MAGIC, SelectorDatabase.VERSION, len(cheats), records_offset, strings_offset),
+            selectors,
+            records,
+            strings.getvalue(),
+        ])
+
+
+# Items processed together by `CalldataDecoder.decode_stream`.
+CALLDATA_BATCH = 4096
+
+# Decodes the arguments of cheatcode calls from raw calldata, in bulk. Calls are classified by
+# selector, and the arguments of known cheatcodes are ABI-decoded with the types of their
+# declaration. Every decoded call is returned as `(selector, signature, args)`: `signature` is
+# `None` for calldata that doesn't call a known cheatcode, and `args` is `None` if the calldata is
+# malformed. Decoders for each cheatcode are compiled the first time it's seen.
+class CalldataDecoder:
+    # `selector -> (signature, ABI inputs)`.
+    functions: dict[int, tuple[str, list[dict]]]
+    _decoders: dict[int, Callable[[bytes, int], tuple]]
+
+    def __init__(self, functions: dict[int, tuple[str, list[dict]]]):
+        self.functions = functions
+        self._decoders = {}
 
     @staticmethod
-    def from_json_file(file_path: str) -> "Cheatcodes":
-        with open(file_path, "r") as f:
-            return Cheatcodes.from_dict(json.load(f))
+    def from_cheatcodes(contract: "Cheatcodes", cheats: list["Cheatcode"]) -> "CalldataDecoder":
+        builder = AbiBuilder(contract)
+        return CalldataDecoder(
+            {cc.func.selector_int: (cc.func.signature, builder.function(cc.func)["inputs"]) for cc in cheats}
+        )
+
+    def decode(self, data: bytes) -> tuple[int | None, str | None, tuple | None]:
+        if len(data) < 4:
+            return None, None, None
+        selector = int.from_bytes(data[:4], "big")
+        function = self.functions.get(selector)
+        if function is None:
+            return selector, None, None
+        decode = self._decoders.get(selector)
+        if decode is None:
+            _, _, decode = abi_decoder({"type": "tuple", "components": function[1]})
+            self._decoders[selector] = decode
+        try:
+            return selector, function[0], decode(data, 4)
+        except ValueError:
+            return selector, function[0], None
+
+    def decode_batch(self, batch: list[bytes]) -> list[tuple[int | None, str | None, tuple | None]]:
+        return [self.decode(data) for data in batch]
+
+    # Decodes calldata as it's read from `items`, `batch_size` items at a time, and yields the
+    # results in the order of `items`. With more than one job, batches are decoded by a pool of
+    # processes, with a bounded number of batches in flight, so that inputs larger than memory can
+    # be streamed through.
+    def decode_stream(
+        self,
+        items: "Iterator[bytes] | list[bytes]",
+        batch_size: int = CALLDATA_BATCH,
+        jobs: int = 1,
+    ) -> Iterator[tuple[int | None, str | None, tuple | None]]:
+        batches = iter_batches(items, batch_size)
+        if jobs <= 1:
+            for batch in batches:
+                yield from self.decode_batch(batch)
+            return
+
+        import concurrent.futures
+
+        with concurrent.futures.ProcessPoolExecutor(
+            jobs, initializer=_init_calldata_worker, initargs=(self.functions,)
+        ) as executor:
+            pending: list[concurrent.futures.Future] = []
+            for batch in batches:
+                pending.append(executor.submit(_decode_calldata_batch, batch))
+                if len(pending) >= 2 * jobs:
+                    yield from pending.pop(0).result()
+            for future in pending:
+                yield from future.result()
+
+
+_calldata_decoder: CalldataDecoder | None = None
+
+
+def _init_calldata_worker(functions: dict[int, tuple[str, list[dict]]]):
+    global _calldata_decoder
+    _calldata_decoder = CalldataDecoder(functions)
+
+
+def _decode_calldata_batch(batch: list[bytes]) -> list[tuple[int | None, str | None, tuple | None]]:
+    assert _calldata_decoder is not None
+    return _calldata_decoder.decode_batch(batch)
+
+
+def iter_batches(items: "Iterator | list", size: int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Reads calldata written one call per line as hex, with or without `0x`. Blank lines are skipped.
+def iter_calldata_lines(stream: "io.IOBase") -> Iterator[bytes]:
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode()
+        line = line.strip()
+        if line:
+            yield bytes.fromhex(line.removeprefix("0x"))
+
+
+# Reads the calldata of the transactions of a `forge script` broadcast log, such as
+# `test/fixtures/broadcast.log.json`, one transaction at a time.
+def iter_broadcast_calldata(stream: "io.IOBase") -> Iterator[bytes]:
+    for key, tx in JsonArrayStream(stream):
+        if key != "transactions" or not isinstance(tx, dict):
+            continue
+        fields = tx.get("transaction") or tx.get("tx") or {}
+        data = fields.get("input") or fields.get("data") or "0x"
+        yield bytes.fromhex(data.removeprefix("0x"))
+
+
+# Compiles the ABI type of `entry` into `(head_size, dynamic, decode)`. `decode(data, pos)` decodes a
+# value whose encoding starts at `pos`, and raises `ValueError` if `data` is too short for it. Dynamic
+# values are stored after an offset in the head of their enclosing tuple or array, relative to its
+# start. Integers decode to `int`, addresses to `0x`-prefixed lowercase hex, `bytes` and `bytesN` to
+# `bytes`, arrays to lists and structs to tuples.
+def abi_decoder(entry: dict) -> tuple[int, bool, Callable[[bytes, int], object]]:
+    ty = entry["type"]
+    if ty.endswith("]"):
+        i = ty.rindex("[")
+        element_size, element_dynamic, decode_element = abi_decoder(dict(entry, type=ty[:i]))
+        length = ty[i + 1:-1]
+
+        def decode_sequence(data: bytes, start: int, n: int) -> list:
+            if element_dynamic:
+                return [decode_element(data, start + abi_word(data, start + 32 * k)) for k in range(n)]
+            return [decode_element(data, start + element_size * k) for k in range(n)]
+
+        if length == "":
+            def decode_dynamic_array(data: bytes, pos: int) -> list:
+                n = abi_word(data, pos)
+                if pos + 32 + n * element_size > len(data):
+                    raise ValueError("array out of bounds")
+                return decode_sequence(data, pos + 32, n)
+
+            return 32, True, decode_dynamic_array
+
+        n = int(length)
+
+        def decode_fixed_array(data: bytes, pos: int) -> list:
+            return decode_sequence(data, pos, n)
+
+        if element_dynamic:
+            return 32, True, decode_fixed_array
+        return element_size * n, False, decode_fixed_array
+
+    if ty == "tuple":
+        components = [abi_decoder(c) for c in entry["components"]]
+        dynamic = any(d for _, d, _ in components)
+        layout = []
+        head = 0
+        for size, component_dynamic, decode_component in components:
+            layout.append((head, component_dynamic, decode_component))
+            head += size
+
+        def decode_tuple(data: bytes, start: int) -> tuple:
+            if start + head > len(data):
+                raise ValueError("tuple out of bounds")
+            return tuple(
+                decode_component(data, start + abi_word(data, start + offset) if component_dynamic else start + offset)
+                for offset, component_dynamic, decode_component in layout
+            )
+
+        return (32 if dynamic else head), dynamic, decode_tuple
+
+    if ty in ("bytes", "string"):
+        def decode_bytes(data: bytes, pos: int) -> bytes | str:
+            n = abi_word(data, pos)
+            if pos + 32 + n > len(data):
+                raise ValueError("bytes out of bounds")
+            value = bytes(data[pos + 32:pos + 32 + n])
+            return value.decode(errors="replace") if ty == "string" else value
+
+        return 32, True, decode_bytes
+
+    if ty.startswith("uint"):
+        return 32, False, abi_word
+    if ty.startswith("int"):
+        def decode_int(data: bytes, pos: int) -> int:
+            return int.from_bytes(abi_slice(data, pos), "big", signed=True)
+
+        return 32, False, decode_int
+    if ty == "address":
+        return 32, False, lambda data, pos: "0x" + abi_slice(data, pos)[12:].hex()
+    if ty == "bool":
+        return 32, False, lambda data, pos: abi_word(data, pos) != 0
+    if ty.startswith("bytes"):
+        n = int(ty[len("bytes"):])
+        return 32, False, lambda data, pos: bytes(abi_slice(data, pos)[:n])
+    raise AssertionError(f"unsupported ABI type: {ty}")
+
+
+def abi_slice(data: bytes, pos: int) -> bytes:
+    if pos + 32 > len(data):
+        raise ValueError("word out of bounds")
+    return data[pos:pos + 32]
+
+
+def abi_word(data: bytes, pos: int) -> int:
+    return int.from_bytes(abi_slice(data, pos), "big")
+
+
+# Splits a declaration such as `function f(uint256 a, bytes b) external returns (bool);` into its
+# head (`function f`), parameters and trailing attributes, where `returns (...)` is a single
+# attribute.
+def split_declaration(decl: str) -> tuple[str, list[str], list[str]]:
+    decl = decl.strip()
+    assert decl.endswith(";"), f"declaration must end with `;`: {decl}"
+    body = decl[:-1]
+    start = body.index("(")
+    depth = 0
+    for end in range(start, len(body)):
+        if body[end] == "(":
+            depth += 1
+        elif body[end] == ")":
+            depth -= 1
+            if depth == 0:
+                break
+    assert depth == 0, f"unbalanced parentheses: {decl}"
+
+    params = []
+    depth = 0
+    param_start = start + 1
+    for i in range(start + 1, end):
+        c = body[i]
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "," and depth == 0:
+            params.append(body[param_start:i].strip())
+            param_start = i + 1
+    last = body[param_start:end].strip()
+    if last != "":
+        params.append(last)
+
+    attrs = []
+    rest = body[end + 1:].strip()
+    while rest != "":
+        if rest.startswith("returns"):
+            attrs.append(rest)
+            break
+        attr, _, rest = rest.partition(" ")
+        attrs.append(attr)
+        rest = rest.strip()
+    return body[:start].rstrip(), params, attrs
+
+
+# Lays out a declaration the way `forge fmt` does. Returns its lines; all but the first are prefixed
+# with one level of `indent_str` relative to the declaration itself, which starts at column `column`.
+def wrap_declaration(decl: str, column: int, line_length: int, indent_str: str) -> list[str]:
+    # `forge fmt` doesn't count the trailing `;` towards the line length.
+    if column + len(decl) - 1 <= line_length:
+        return [decl]
+
+    head, params, attrs = split_declaration(decl)
+    header = f"{head}({', '.join(params)})"
+    if attrs and column + len(header) <= line_length:
+        # Keep the parameters on the first line, and put every attribute on a line of its own.
+        return [header] + [indent_str + attr for attr in attrs[:-1]] + [f"{indent_str}{attrs[-1]};"]
+
+    # Otherwise, put every parameter on a line of its own.
+    lines = [f"{head}("]
+    for i, param in enumerate(params):
+        lines.append(indent_str + param + ("," if i < len(params) - 1 else ""))
+    lines.append(" ".join([")"] + attrs) + ";")
+    return lines
 
 
 class Item(PyEnum):
@@ -405,40 +3165,109 @@ class ItemOrder:
         )
 
 
+COMMENT_STYLES = ("full", "summary", "none")
+
+# Rendering profiles selectable with `--profile`, as printer options.
+PROFILES = {
+    "full": dict(comments="full", group_headers=True),
+    # Only the first line of doc comments, without field comments or group banners.
+    "summary": dict(comments="summary", group_headers=False),
+    # No comments or group banners at all, for machines that never show them to a human.
+    "compact": dict(comments="none", group_headers=False),
+}
+
+
+# In-memory sink that collects written text as a list of chunks.
+class ChunkSink:
+    chunks: list[str]
+
+    def __init__(self) -> None:
+        self.chunks = []
+
+    def write(self, txt: str) -> int:
+        self.chunks.append(txt)
+        return len(txt)
+
+    def getvalue(self) -> str:
+        return "".join(self.chunks)
+
+    def clear(self):
+        self.chunks.clear()
+
+
 class CheatcodesPrinter:
-    buffer: str
+    sink: "ChunkSink | io.TextIOBase | io.BufferedIOBase"
 
     prelude: bool
     spdx_identifier: str
     solidity_requirement: str
 
+    # One of `COMMENT_STYLES`: "full" comments, only the first line of doc comments ("summary"), or
+    # no comments at all ("none").
+    comments: str
     block_doc_style: bool
+    group_headers: bool
+    memory_to_calldata: bool
+
+    # Emit output in the same layout as `forge fmt`, so that it doesn't have to be run afterwards.
+    canonical: bool
+    line_length: int
+    _line_indented: bool
+
+    fragment_cache: "FragmentCache | None"
+    _capturing: int
+
+    # Renders functions in parallel when set, see `_p_functions_parallel`.
+    executor: "concurrent.futures.Executor | None"
+    # Number of workers of `executor`.
+    jobs: int
 
     indent_level: int
     _indent_str: str
+    _indents: list[str]
+    _indent: str
 
     nl_str: str
 
     items_order: ItemOrder
 
+    flush_every: int
+    _chunks: list[str]
+    _pending_ws: str
+    _write: Callable[[str], object]
+
     def __init__(
         self,
-        buffer: str = "",
+        sink: "ChunkSink | io.TextIOBase | io.BufferedIOBase | None" = None,
         prelude: bool = True,
         spdx_identifier: str = "UNLICENSED",
         solidity_requirement: str = "",
+        comments: str = "full",
         block_doc_style: bool = False,
+        group_headers: bool = False,
+        memory_to_calldata: bool = False,
+        canonical: bool = False,
+        line_length: int = 120,
         indent_level: int = 0,
         indent_with: int | str = 4,
         nl_str: str = "\n",
         items_order: ItemOrder = ItemOrder.default(),
+        flush_every: int = 4096,
+        fragment_cache: "FragmentCache | None" = None,
+        executor: "concurrent.futures.Executor | None" = None,
+        jobs: int = 1,
     ):
         self.prelude = prelude
         self.spdx_identifier = spdx_identifier
         self.solidity_requirement = solidity_requirement
+        assert comments in COMMENT_STYLES, f"comments must be one of {COMMENT_STYLES}"
+        self.comments = comments
         self.block_doc_style = block_doc_style
-        self.buffer = buffer
-        self.indent_level = indent_level
+        self.group_headers = group_headers
+        self.memory_to_calldata = memory_to_calldata
+        self.canonical = canonical
+        self.line_length = line_length
+        self._line_indented = False
         self.nl_str = nl_str
 
         if isinstance(indent_with, int):
@@ -449,19 +3278,81 @@ class CheatcodesPrinter:
         else:
             assert False, "indent_with must be int or str"
 
+        assert indent_level >= 0
+        self._indents = [""]
+        self.indent_level = 0
+        self._indent = ""
+        self._set_indent(indent_level)
+
         self.items_order = items_order
 
-    def finish(self) -> str:
-        ret = self.buffer.rstrip()
-        self.buffer = ""
-        return ret
+        assert flush_every > 0
+        self.flush_every = flush_every
+        self._chunks = []
+        self._pending_ws = ""
+
+        self.fragment_cache = fragment_cache
+        self._capturing = 0
+
+        self.executor = executor
+        assert jobs >= 1
+        self.jobs = jobs
+
+        self.sink = sink if sink is not None else ChunkSink()
+        if isinstance(self.sink, (io.RawIOBase, io.BufferedIOBase)):
+            self._write = lambda txt: self.sink.write(txt.encode("utf-8"))
+        else:
+            self._write = self.sink.write
+
+    # Flushes buffered output, replacing any trailing whitespace with `end`. Returns the text written
+    # since the last call when the sink is a `ChunkSink`, and an empty string for any other sink.
+    def finish(self, end: str = "") -> str:
+        self.flush()
+        self._pending_ws = ""
+        if end != "":
+            self._write(end)
+        if isinstance(self.sink, ChunkSink):
+            ret = self.sink.getvalue()
+            self.sink.clear()
+            return ret
+        return ""
+
+    # Writes buffered chunks to the sink in a single call. Trailing whitespace is held back until
+    # more text follows so that `finish` can drop it without rewriting what was already written.
+    def flush(self):
+        if not self._chunks:
+            return
+        txt = "".join(self._chunks)
+        self._chunks.clear()
+        body = txt.rstrip()
+        if body == "":
+            self._pending_ws += txt
+            return
+        trailing = txt[len(body):]
+        self._write(self._pending_ws + body)
+        self._pending_ws = trailing
+
+    def p_raw(self, txt: str):
+        self._p_str(txt)
 
     def p_contract(self, contract: Cheatcodes, name: str, inherits: str = ""):
         if self.prelude:
             self.p_prelude(contract)
 
-        self._p_str("interface ")
         name = name.strip()
+        if self.canonical and inherits != "":
+            header = f"interface {name} is {inherits} {{"
+            if len(self._indent) + len(header) > self.line_length:
+                # Like `forge fmt`, put every base on a line of its own.
+                bases = [base.strip() for base in inherits.split(",")]
+                self._p_str(f"interface {name} is")
+                self._with_indent(lambda: self._p_bases(bases))
+                self._p_nl()
+                self._p_indent()
+                self._p_body(contract)
+                return
+
+        self._p_str("interface ")
         if name != "":
             self._p_str(name)
             self._p_str(" ")
@@ -469,12 +3360,33 @@ class CheatcodesPrinter:
             self._p_str("is ")
             self._p_str(inherits)
             self._p_str(" ")
+        self._p_body(contract)
+
+    # Prints the braces of an interface and its items. Like `forge fmt`, canonical mode prints an
+    # interface without items, such as `Vm` when pruning leaves no unsafe cheatcodes, as `{}`.
+    def _p_body(self, contract: Cheatcodes):
+        if self.canonical and not (
+            contract.errors or contract.events or contract.enums or contract.structs or contract.cheatcodes
+        ):
+            self._p_str("{}")
+            self._p_nl()
+            return
         self._p_str("{")
         self._p_nl()
         self._with_indent(lambda: self._p_items(contract))
+        if self.canonical:
+            self._trim_blank_lines()
         self._p_str("}")
         self._p_nl()
 
+    def _p_bases(self, bases: list[str]):
+        for i, base in enumerate(bases):
+            self._p_nl()
+            self._p_indent()
+            self._p_str(base)
+            if i < len(bases) - 1:
+                self._p_str(",")
+
     def _p_items(self, contract: Cheatcodes):
         for item in self.items_order.get_list():
             if item == Item.ERROR:
@@ -509,21 +3421,31 @@ class CheatcodesPrinter:
 
     def p_error(self, error: Error):
         self._p_comment(error.description, doc=True)
-        self._p_line(lambda: self._p_str(error.declaration))
+        self._p_line(lambda: self._p_declaration(error.declaration))
 
     def p_events(self, events: list[Event]):
         for event in events:
             self._p_line(lambda: self.p_event(event))
 
     def p_event(self, event: Event):
+        key = ("event", event.name, event.description, event.declaration)
+        self._p_cached(key, lambda: self._p_event(event))
+
+    def _p_event(self, event: Event):
         self._p_comment(event.description, doc=True)
-        self._p_line(lambda: self._p_str(event.declaration))
+        self._p_line(lambda: self._p_declaration(event.declaration))
 
     def p_enums(self, enums: list[Enum]):
         for enum in enums:
             self._p_line(lambda: self.p_enum(enum))
 
     def p_enum(self, enum: Enum):
+        key = ("enum", enum.name, enum.description)
+        for variant in enum.variants:
+            key += (variant.name, variant.description)
+        self._p_cached(key, lambda: self._p_enum(enum))
+
+    def _p_enum(self, enum: Enum):
         self._p_comment(enum.description, doc=True)
         self._p_line(lambda: self._p_str(f"enum {enum.name} {{"))
         self._with_indent(lambda: self.p_enum_variants(enum.variants))
@@ -545,6 +3467,12 @@ class CheatcodesPrinter:
             self._p_line(lambda: self.p_struct(struct))
 
     def p_struct(self, struct: Struct):
+        key = ("struct", struct.name, struct.description)
+        for field in struct.fields:
+            key += (field.name, field.ty, field.description)
+        self._p_cached(key, lambda: self._p_struct(struct))
+
+    def _p_struct(self, struct: Struct):
         self._p_comment(struct.description, doc=True)
         self._p_line(lambda: self._p_str(f"struct {struct.name} {{"))
         self._with_indent(lambda: self.p_struct_fields(struct.fields))
@@ -559,17 +3487,129 @@ class CheatcodesPrinter:
         self._p_indented(lambda: self._p_str(f"{field.ty} {field.name};"))
 
     def p_functions(self, cheatcodes: list[Cheatcode]):
-        for cheatcode in cheatcodes:
-            self._p_line(lambda: self.p_function(cheatcode.func))
+        if self.executor is not None and len(cheatcodes) > 1:
+            self._p_functions_parallel(cheatcodes)
+            return
+        items = with_group_headers(cheatcodes) if self.group_headers else cheatcodes
+        for item in items:
+            if isinstance(item, GroupHeader):
+                self._p_line(lambda: self.p_group_header(item))
+            else:
+                self._p_line(lambda: self.p_function(item.func))
+
+    # Renders contiguous runs of the same group in `executor` and splices the results back in order.
+    # Large groups are split further so that work is spread evenly over the workers. Functions are
+    # looked up in, and added to, the fragment cache under the same keys as when rendered serially.
+    def _p_functions_parallel(self, cheatcodes: list[Cheatcode]):
+        max_shard = max(1, -(-len(cheatcodes) // (self.jobs * 4)))
+        options = self._fragment_options()
+        cache = self.fragment_cache
+        seen = set()
+        shards = []
+        digests = []
+        start = 0
+        for i in range(1, len(cheatcodes) + 1):
+            if i < len(cheatcodes) and cheatcodes[i].group == cheatcodes[start].group and i - start < max_shard:
+                continue
+            g = cheatcodes[start].group
+            header = self.group_headers and g not in seen
+            seen.add(g)
+            # Only plain strings are sent to the workers, as pickling the models is much slower.
+            items = []
+            shard_digests = []
+            for cc in cheatcodes[start:i]:
+                fragment = None
+                if cache is not None:
+                    # `p_function` runs after `_p_line` indented the line.
+                    key = ("function", cc.func.description, cc.func.declaration)
+                    digest = cache.digest(self._fragment_key(key, line_indented=self.canonical))
+                    fragment = cache.get(digest)
+                    if fragment is None:
+                        shard_digests.append(digest)
+                decl = cc.func.calldata_declaration() if self.memory_to_calldata else cc.func.declaration
+                items.append((cc.func.description, decl, fragment))
+            shards.append((options, self.indent_level, g if header else None, items, cache is not None))
+            digests.append(shard_digests)
+            start = i
+
+        results = self.executor.map(_render_functions_shard, *zip(*shards))
+        for (txt, fragments), shard_digests in zip(results, digests):
+            self._chunks.append(txt)
+            for digest, fragment in zip(shard_digests, fragments):
+                cache.put(digest, fragment)
+        self._line_indented = False
+        if self._capturing == 0:
+            self.flush()
+
+    def p_group_header(self, header: GroupHeader):
+        self._p_line(lambda: self._p_str(f"// ======== {group(header.group)} ========"))
 
     def p_function(self, func: Function):
+        key = ("function", func.description, func.declaration)
+        self._p_cached(key, lambda: self._p_function(func))
+
+    def _p_function(self, func: Function):
         self._p_comment(func.description, doc=True)
-        self._p_line(lambda: self._p_str(func.declaration))
+        decl = func.calldata_declaration() if self.memory_to_calldata else func.declaration
+        self._p_line(lambda: self._p_declaration(decl))
+
+    def _p_declaration(self, decl: str):
+        if not self.canonical:
+            self._p_str(decl)
+            return
+        lines = wrap_declaration(decl, len(self._indent), self.line_length, self._indent_str)
+        self._p_str(lines[0])
+        for line in lines[1:]:
+            self._p_nl()
+            self._p_indent()
+            self._p_str(line)
+
+    # Renders an item through `render`, or splices in its previously rendered text from the
+    # fragment cache. Items always end with a newline.
+    def _p_cached(self, key: tuple[str, ...], render: VoidFn):
+        cache = self.fragment_cache
+        if cache is None:
+            render()
+            return
+
+        digest = cache.digest(self._fragment_key(key, self._line_indented))
+        fragment = cache.get(digest)
+        if fragment is not None:
+            self._chunks.append(fragment)
+            self._line_indented = False
+            return
+
+        start = len(self._chunks)
+        self._capturing += 1
+        try:
+            render()
+        finally:
+            self._capturing -= 1
+        cache.put(digest, "".join(self._chunks[start:]))
+
+    # The fragment cache key of the item `key`, rendered with the current options and indentation.
+    def _fragment_key(self, key: tuple[str, ...], line_indented: bool) -> tuple[str, ...]:
+        return (repr(self._fragment_options()), str(self.indent_level), str(line_indented)) + key
+
+    def _fragment_options(self) -> tuple:
+        return (
+            self.comments,
+            self.block_doc_style,
+            self.memory_to_calldata,
+            self.canonical,
+            self.line_length,
+            self._indent_str,
+            self.nl_str,
+        )
 
     def _p_comment(self, s: str, doc: bool = False):
+        if self.comments != "full" and (self.comments == "none" or not doc):
+            return
         s = s.strip()
         if s == "":
             return
+        if self.comments == "summary":
+            s = s.split("\n", 1)[0]
 
         s = map(lambda line: line.lstrip(), s.split("\n"))
         if self.block_doc_style:
@@ -594,11 +3634,12 @@ class CheatcodesPrinter:
                     self._p_indent()
                 first_line = False
 
-                if doc:
-                    self._p_str("/// ")
+                prefix = "/// " if doc else "// "
+                if self.canonical:
+                    self._p_str((prefix + line).rstrip())
                 else:
-                    self._p_str("// ")
-                self._p_str(line)
+                    self._p_str(prefix)
+                    self._p_str(line)
                 self._p_nl()
 
     def _with_indent(self, f: VoidFn):
@@ -616,20 +3657,82 @@ class CheatcodesPrinter:
         f()
 
     def _p_indent(self):
-        for _ in range(self.indent_level):
-            self._p_str(self._indent_str)
+        # In canonical mode, a line is never indented twice, e.g. when an item has no doc comment.
+        if self.canonical:
+            if self._line_indented:
+                return
+            self._line_indented = True
+        self._chunks.append(self._indent)
 
     def _p_nl(self):
-        self._p_str(self.nl_str)
+        self._line_indented = False
+        self._chunks.append(self.nl_str)
+        if len(self._chunks) >= self.flush_every and self._capturing == 0:
+            self.flush()
 
     def _p_str(self, txt: str):
-        self.buffer += txt
+        self._chunks.append(txt)
+
+    # Collapses the blank lines at the end of the output so far into a single newline.
+    def _trim_blank_lines(self):
+        self.flush()
+        if self._pending_ws != "":
+            self._pending_ws = self.nl_str
+
+    def _set_indent(self, level: int):
+        while len(self._indents) <= level:
+            self._indents.append(self._indents[-1] + self._indent_str)
+        self.indent_level = level
+        self._indent = self._indents[level]
 
     def _inc_indent(self):
-        self.indent_level += 1
+        self._set_indent(self.indent_level + 1)
 
     def _dec_indent(self):
-        self.indent_level -= 1
+        self._set_indent(self.indent_level - 1)
+
+
+# Worker for `CheatcodesPrinter._p_functions_parallel`. `options` is the tuple returned by
+# `_fragment_options`, and `items` holds the description, final declaration and cached fragment, if
+# any, of each function. Returns the rendered text, and with `capture`, the fragments of the functions
+# that weren't cached, in order.
+def _render_functions_shard(
+    options: tuple,
+    indent_level: int,
+    header: str | None,
+    items: list[tuple[str, str, str | None]],
+    capture: bool,
+) -> tuple[str, list[str]]:
+    comments, block_doc_style, _, canonical, line_length, indent_with, nl_str = options
+    pp = CheatcodesPrinter(
+        prelude=False,
+        comments=comments,
+        block_doc_style=block_doc_style,
+        canonical=canonical,
+        line_length=line_length,
+        indent_level=indent_level,
+        indent_with=indent_with,
+        nl_str=nl_str,
+    )
+    # Keep everything in the chunk buffer, including trailing whitespace that `finish` would drop.
+    pp._capturing += 1
+    if header is not None:
+        pp._p_line(lambda: pp.p_group_header(GroupHeader(header)))
+    rendered = []
+    for description, declaration, fragment in items:
+        # The same steps as `_p_line(lambda: p_function(func))`, with `_p_cached` splicing in or
+        # capturing the fragment.
+        pp._p_indent()
+        if fragment is None:
+            start = len(pp._chunks)
+            pp._p_function(Function("", description, declaration, Visibility.EXTERNAL, Mutability.NONE, "", 0))
+            if capture:
+                rendered.append("".join(pp._chunks[start:]))
+        else:
+            pp._chunks.append(fragment)
+            pp._line_indented = False
+        pp._p_nl()
+    return "".join(pp._chunks), rendered
 
 
 if __name__ == "__main__":